@@ -6,11 +6,19 @@ except ModuleNotFoundError:
 
 from .types import *
 from .exceptions import *
+from .stats import *
+from .codec import *
 from .read import *
 from .write import *
 from .decode import *
 from .encode import *
+from .extract import *
+from .digest import *
+from .immutable import *
+from .cache import *
 
 from . import json
 from . import yaml
 from . import cjson
+from . import lazy
+from . import aio
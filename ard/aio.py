@@ -0,0 +1,173 @@
+
+import io, cbor2
+from .exceptions import *
+from .codec import readers, writers
+from .lazy import _scan_item
+from .buffer import DEFAULT_SIZE
+from . import cbor
+
+__all__ = (
+  'read_all',
+  'write_all')
+
+
+
+async def read_all(source, format='json'):
+  '''
+  Asynchronously yields the values of a multi-value stream one at a time: JSON Lines, CJSON Lines,
+  or a CBOR sequence.
+
+  The source can be an asyncio.StreamReader (or anything else with an async read(n)) or an async
+  iterable of bytes-like chunks. Values are yielded as soon as they are complete, so chunks do not
+  have to be aligned with them, and only the incomplete value at the end is buffered.
+  '''
+  if format not in ('json', 'cjson', 'cbor'):
+    raise ARDException('unsupported format: ' + format)
+  reader = readers.acquire(format)
+  try:
+    if format == 'cbor':
+      values = _read_all_cbor(_chunks(source), reader)
+    else:
+      values = _read_all_lines(_chunks(source), reader)
+    async for value in values:
+      yield value
+  except ARDException:
+    raise
+  except Exception as e:
+    # The reader's state is unknown, so we will not return it to the pool
+    raise DecodeError(format) from e
+  readers.release(reader, format)
+
+async def write_all(values, writer, format='json'):
+  '''
+  Writes values as a multi-value stream: JSON Lines, CJSON Lines, or a CBOR sequence.
+
+  The values can be an iterable or an async iterable. The writer can be an asyncio.StreamWriter (or
+  anything else with write(bytes) and an async drain()), which is drained for backpressure.
+
+  Values from an iterable are batched into large writes. Values from an async iterable, which may
+  take a while to arrive, are written as soon as they are encoded.
+  '''
+  if format not in ('json', 'cjson', 'cbor'):
+    raise ARDException('unsupported format: ' + format)
+  writer_ = writers.acquire(format)
+  binary = format == 'cbor'
+  stream = io.BytesIO() if binary else io.StringIO()
+
+  async def drain():
+    data = stream.getvalue()
+    stream.seek(0)
+    stream.truncate()
+    if data:
+      writer.write(data if binary else data.encode('utf-8'))
+      await writer.drain()
+
+  if hasattr(values, '__aiter__'):
+    async for value in values:
+      _write(writer_, value, stream, format)
+      await drain()
+  else:
+    for value in values:
+      _write(writer_, value, stream, format)
+      if stream.tell() >= DEFAULT_SIZE:
+        await drain()
+    await drain()
+  writers.release(writer_, format)
+
+def _write(writer_, value, stream, format):
+  # Our writers' single-value form (without indentation) is exactly a line or a sequence item
+  try:
+    writer_.write(value, stream)
+  except Exception as e:
+    raise EncodeError(format) from e
+
+async def _chunks(source):
+  read = getattr(source, 'read', None)
+  if read is not None:
+    while True:
+      chunk = await read(DEFAULT_SIZE)
+      if not chunk:
+        return
+      yield chunk if isinstance(chunk, bytes) else bytes(chunk)
+  else:
+    async for chunk in source:
+      yield chunk if isinstance(chunk, bytes) else bytes(chunk)
+
+async def _read_all_lines(chunks, reader):
+  pending = bytearray()
+  async for chunk in chunks:
+    end = chunk.rfind(b'\n') + 1
+    if end == 0:
+      pending += chunk
+      continue
+    if pending:
+      pending += memoryview(chunk)[:end]
+      lines = str(pending, 'utf-8')
+      pending.clear()
+    else:
+      lines = str(memoryview(chunk)[:end], 'utf-8')
+    pending += memoryview(chunk)[end:]
+    # The reader skips empty lines, including the one after the last newline
+    for value in reader.read_all(lines.split('\n')):
+      yield value
+  if pending:
+    for value in reader.read_all((str(pending, 'utf-8'),)):
+      yield value
+
+async def _read_all_cbor(chunks, reader):
+  # Complete items are decoded straight from the chunk. An incomplete item at the end of a chunk is
+  # collected (with a _Framer finding where it ends) and decoded once it is complete, so that large
+  # items are not decoded over and over again.
+  decoder = reader.decoder
+  pending = bytearray()
+  framer = None
+  try:
+    async for chunk in chunks:
+      if framer is not None:
+        pending += chunk
+        if framer.end(pending) is None:
+          continue
+        data = bytes(pending)
+        pending.clear()
+        framer = None
+      else:
+        data = chunk
+
+      stream = io.BytesIO(data)
+      decoder.fp = stream
+      length = len(data)
+      position = 0
+      while position < length:
+        try:
+          value = decoder.decode()
+        except cbor2.CBORDecodeEOF:
+          pending += memoryview(data)[position:]
+          framer = _Framer()
+          framer.end(pending)
+          break
+        position = stream.tell()
+        yield value
+  finally:
+    decoder.fp = cbor._NO_STREAM
+
+  if framer is not None:
+    raise ValueError('truncated CBOR')
+
+
+class _Framer:
+  '''
+  Finds where a CBOR data item ends in a buffer that is still growing, resuming where it left off.
+  '''
+
+  __slots__ = ('offset', 'pending')
+
+  def __init__(self):
+    self.offset = 0
+    self.pending = [1]
+
+  def end(self, buffer):
+    # Returns the offset after the data item, or None if it is incomplete
+    self.offset = offset = _scan_item(buffer, self.offset, self.pending)
+    if self.pending or (offset > len(buffer)):
+      return None
+    return offset
@@ -0,0 +1,77 @@
+
+import io, binascii
+
+__all__ = ('Buffer',)
+
+DEFAULT_SIZE = 64 * 1024
+
+# The bytes-like classes accepted as ARD bytes values
+BYTES_CLASSES = (bytes, bytearray, memoryview)
+
+# A multiple of 3, so that the base64 of the chunks can be joined without padding in between
+BASE64_CHUNK_SIZE = 48 * 1024
+
+# How many chunks a ChunkEncoder collects before flushing
+MAX_CHUNKS = 8192
+
+
+class Buffer:
+  '''
+  Collects output in an in-memory stream and passes it on to a writer in large batches.
+  '''
+
+  __slots__ = ('writer', 'stream', 'size')
+
+  def __init__(self, writer, binary=False, size=DEFAULT_SIZE):
+    self.writer = writer
+    self.stream = io.BytesIO() if binary else io.StringIO()
+    self.size = size
+
+  def drain(self, force=False):
+    '''
+    Passes the collected output on to the writer if there is enough of it (or any if force is True).
+    '''
+    if force or (self.stream.tell() >= self.size):
+      data = self.stream.getvalue()
+      if data:
+        self.writer.write(data)
+      self.stream.seek(0)
+      self.stream.truncate()
+
+
+class ChunkEncoder:
+  '''
+  Base class for encoders that collect text chunks, which subclasses should flush to the writer when
+  there are more than MAX_CHUNKS of them.
+  '''
+
+  __slots__ = ('writer', 'indent', 'chunks')
+
+  def __init__(self, writer, indent):
+    self.writer = writer
+    self.indent = indent
+    self.chunks = []
+
+  def flush(self):
+    self.writer.write(''.join(self.chunks))
+    self.chunks.clear()
+
+
+def byte_view(value):
+  '''
+  A flat memoryview of the bytes of a bytes-like object, which is copied only if it is not contiguous.
+  '''
+  view = memoryview(value)
+  if not view.c_contiguous:
+    return memoryview(view.tobytes())
+  if (view.format != 'B') or (view.ndim != 1):
+    return view.cast('B')
+  return view
+
+def base64_chunks(view):
+  '''
+  Yields the base64 of a byte_view() as text chunks (without a newline at the end), so that large
+  values do not have to be encoded whole.
+  '''
+  for start in range(0, len(view), BASE64_CHUNK_SIZE):
+    yield binascii.b2a_base64(view[start:start + BASE64_CHUNK_SIZE], newline=False).decode()
@@ -0,0 +1,78 @@
+
+import collections, hashlib, threading
+from .decode import *
+from .immutable import *
+
+__all__ = (
+  'DecodeCache',)
+
+
+class DecodeCache:
+  '''
+  A least-recently-used cache of decoded values, keyed by the format and the SHA-256 of the code.
+
+  Cached values are deeply immutable (see freeze()), so that they can be shared between callers (and
+  threads) without copying. Note that this means that results are Maps and tuples rather than dicts
+  and lists.
+
+  Entries are evicted when there are more than max_entries of them or when the total size of their
+  code is more than max_bytes. Code larger than max_bytes is decoded but not cached.
+
+  Thread-safe. Concurrent misses for the same code may decode it more than once.
+  '''
+  def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def decode(self, code, format='yaml'):
+    '''
+    Like ard.decode(), but returns the cached value if the same code was decoded before.
+    '''
+    data = code.encode('utf-8') if isinstance(code, str) else code
+    key = format, isinstance(code, str), hashlib.sha256(data).digest()
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+      self.misses += 1
+
+    value = freeze(decode(code, format))
+    size = len(data) if isinstance(data, bytes) else memoryview(data).nbytes
+    if size > self.max_bytes:
+      return value
+
+    with self._lock:
+      if key not in self._entries:
+        self._entries[key] = value, size
+        self.size += size
+        while (len(self._entries) > self.max_entries) or (self.size > self.max_bytes):
+          _, (_, size_) = self._entries.popitem(last=False)
+          self.size -= size_
+          self.evictions += 1
+    return value
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.size = 0
+
+  def as_dict(self):
+    with self._lock:
+      return {
+        'entries': len(self._entries),
+        'size': self.size,
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions}
+
+  def __len__(self):
+    return len(self._entries)
+
@@ -1,54 +1,256 @@
 
-import collections, cbor2
+import collections, io, cbor2
 from .types import *
+from .buffer import *
+from .buffer import byte_view
+from .transform import *
+from .stats import timed
+from . import lazy
 
 __all__ = (
+  'Reader',
+  'Writer',
+  'read',
+  'object_hook',
   'encoder_default',
-  'convert_frozendicts_to_maps')
+  'convert_frozendicts_to_maps',
+  'canonicalize')
 
+_LEAF_CLASSES = frozenset((str, int, float, bool, bytes, type(None)))
+
+# cbor2 requires a valid stream at all times, so we use this one when idle
+_NO_STREAM = io.BytesIO()
+
+
+class Reader:
+  '''
+  A reusable CBOR reader.
+  '''
+  def __init__(self):
+    self.decoder = cbor2.CBORDecoder(_NO_STREAM, object_hook=object_hook)
+
+  def read(self, stream):
+    self.decoder.fp = stream
+    try:
+      return self.decoder.decode()
+    finally:
+      self.decoder.fp = _NO_STREAM
+
+  def read_all(self, stream):
+    '''
+    Yields the items of a CBOR sequence (RFC 8742) one at a time.
+
+    Raises an error if the stream ends in the middle of an item. Streams that can neither peek nor
+    seek are buffered, so that we can tell.
+    '''
+    if (getattr(stream, 'peek', None) is None) and (not stream.seekable()):
+      stream = io.BufferedReader(_RawReader(stream))
+    self.decoder.fp = stream
+    try:
+      while not _at_end(stream):
+        yield self.decoder.decode()
+    finally:
+      self.decoder.fp = _NO_STREAM
+
+
+class Writer:
+  '''
+  A reusable CBOR writer.
+
+  If canonical is True the output is deterministic (see canonicalize()).
+  '''
+  def __init__(self, canonical=False):
+    self.canonical = canonical
+    self.encoder = cbor2.CBOREncoder(_NO_STREAM, default=encoder_default, canonical=canonical)
+
+  def write(self, value, writer):
+    if self.canonical:
+      value = canonicalize(value)
+    self.encoder.fp = writer
+    try:
+      self.encoder.encode(value)
+    finally:
+      self.encoder.fp = _NO_STREAM
+
+  def write_all(self, values, writer):
+    '''
+    Writes the values as a CBOR sequence (RFC 8742), batching the writes.
+    '''
+    buffer = Buffer(writer, binary=True)
+    self.encoder.fp = buffer.stream
+    try:
+      for value in values:
+        if self.canonical:
+          value = canonicalize(value)
+        self.encoder.encode(value)
+        buffer.drain()
+    finally:
+      self.encoder.fp = _NO_STREAM
+    buffer.drain(True)
+
+
+def read(stream):
+  '''
+  Reads CBOR, converting maps with complex keys while decoding.
+  The result is identical to that of convert_frozendicts_to_maps(cbor2.load(stream)).
+  '''
+  return cbor2.CBORDecoder(stream, object_hook=object_hook).decode()
+
+def _at_end(stream):
+  '''
+  True if there is nothing more to read from the stream, which must be able to peek or seek.
+  '''
+  peek = getattr(stream, 'peek', None)
+  if peek is not None:
+    return not peek(1)
+  position = stream.tell()
+  at_end = not stream.read(1)
+  stream.seek(position)
+  return at_end
+
+
+class _RawReader(io.RawIOBase):
+  '''
+  Adapts a stream that only has read() for io.BufferedReader.
+  '''
+  def __init__(self, stream):
+    self.stream = stream
+
+  def readable(self):
+    return True
+
+  def readinto(self, buffer):
+    data = self.stream.read(len(buffer))
+    buffer[:len(data)] = data
+    return len(data)
+
+
+def object_hook(decoder, value):
+  '''
+  A CBORDecoder object_hook that converts maps with complex keys to Maps.
+  '''
+  if decoder.immutable:
+    # We are (within) a key, so we must remain hashable; the containing map will convert us
+    return value
+  for key in value:
+    if isinstance(key, (cbor2.FrozenDict, tuple)):
+      break
+  else:
+    return value
+  map_ = Map()
+  for key, value_ in value.items():
+    map_[convert_frozendicts_to_maps(key)] = value_
+  return map_.dict()
 
 def encoder_default(encoder, value):
   if isinstance(value, Map):
     return encoder.encode_map(value)
-  raise cbor2.types.CBOREncodeTypeError('cannot serialize type ' + type(value).__name__)
+  elif isinstance(value, (lazy.LazyMap, lazy.LazyList)):
+    return encoder.encode(value.materialize())
+  elif isinstance(value, memoryview):
+    # A byte string written straight from the view (cbor2 itself handles bytes and bytearray)
+    view = byte_view(value)
+    encoder.encode_length(2, len(view))
+    return encoder.fp.write(view)
+  raise cbor2.CBOREncodeTypeError('cannot serialize type ' + type(value).__name__)
 
+@timed('convert.cbor')
 def convert_frozendicts_to_maps(value):
-  value, _ = _convert_frozendicts_to_maps(value)
-  return value
+  return transform(value, _expand, _LEAF_CLASSES)
 
-def _convert_frozendicts_to_maps(value):
+def _expand(value):
   if isinstance(value, list):
-    converted = False
-    list_ = []
-    for value_ in value:
-      value_, value_converted = _convert_frozendicts_to_maps(value_)
-      if value_converted:
-        converted = True
-      list_.append(value_)
-    if converted:
-      return list_, True
+    return value, build_list
 
   elif isinstance(value, tuple):
-    converted = False
-    list_ = []
-    for value_ in value:
-      value_, value_converted = _convert_frozendicts_to_maps(value_)
-      if value_converted:
-        converted = True
-      list_.append(value_)
-    if converted:
-      return tuple(list_), True
+    return value, build_tuple
 
   elif isinstance(value, collections.abc.Mapping):
-    map_ = Map()
-    converted = isinstance(value, cbor2.types.FrozenDict)
-    for key in value:
-      value_, value_converted = _convert_frozendicts_to_maps(value[key])
-      key, key_converted = _convert_frozendicts_to_maps(key)
-      map_[key] = value_
-      if key_converted or value_converted:
-        converted = True
-    if converted:
-      return map_.dict(), True
-
-  return value, False
+    return items_of(value), _build_mapping
+
+  return None
+
+def _build_mapping(value, results, converted):
+  if converted or isinstance(value, cbor2.FrozenDict):
+    return Map(pairs_of(results)).dict()
+  return value
+
+@timed('canonicalize.cbor')
+def canonicalize(value):
+  '''
+  Prepares the value for cbor2's canonical mode, so that the encoding is deterministic as per RFC
+  8949 section 4.2.1: map entries are sorted by the bytewise order of their encoded keys (including
+  complex keys), and integers and floats use their shortest forms.
+
+  cbor2 sorts keys by their encoded length, which is the same order for keys of a single kind (text,
+  byte strings, non-negative integers, or simple values and floats), because the length is in the head.
+  Other mappings are sorted here and returned as Maps in that order, which cbor2 then keeps.
+  '''
+  return transform(value, _expand_canonical, _LEAF_CLASSES)
+
+def _expand_canonical(value):
+  if isinstance(value, (lazy.LazyMap, lazy.LazyList)):
+    return None, canonicalize(value.materialize())
+
+  if value.__class__ is dict:
+    # Shortcuts for dicts with text keys, which cbor2 can already handle
+    build = None
+    for key, value_ in value.items():
+      if key.__class__ is not str:
+        return items_of(value), _build_canonical_mapping
+      if value_.__class__ not in _CANONICAL_LEAF_CLASSES:
+        build = _build_text_mapping
+    if build is None:
+      return None
+    return items_of(value), build
+
+  elif isinstance(value, collections.abc.Mapping):
+    return items_of(value), _build_canonical_mapping
+
+  elif isinstance(value, list):
+    for item in value:
+      if item.__class__ not in _CANONICAL_LEAF_CLASSES:
+        return value, build_list
+    return None
+
+  elif isinstance(value, tuple):
+    return value, build_tuple
+
+  return None
+
+def _build_text_mapping(value, results, converted):
+  return dict(pairs_of(results)) if converted else value
+
+def _build_canonical_mapping(value, results, converted):
+  kind = None
+  for key in results[::2]:
+    class_ = key.__class__
+    if (class_ is int) or (class_ is UInteger):
+      if 0 <= key < _INTEGER_LIMIT:
+        kind_ = 'unsigned'
+      elif -_INTEGER_LIMIT <= key < 0:
+        kind_ = 'negative'
+      else:
+        # Bignums are tagged
+        break
+    else:
+      kind_ = _KEY_KINDS.get(class_)
+    if kind_ is None:
+      break
+    if kind_ != kind:
+      if kind is not None:
+        break
+      kind = kind_
+  else:
+    if converted or (value.__class__ is not dict):
+      return dict(pairs_of(results))
+    return value
+  return Map(sorted(pairs_of(results), key=_sort_key))
+
+# The kinds of keys that cbor2 itself sorts in the canonical order (integers are checked separately)
+_CANONICAL_LEAF_CLASSES = _LEAF_CLASSES | {UInteger, bytearray, memoryview}
+_KEY_KINDS = {str: 'text', bytes: 'bytes', bool: 'simple', type(None): 'simple', float: 'simple'}
+_INTEGER_LIMIT = 2 ** 64
+
+def _sort_key(pair):
+  return cbor2.dumps(pair[0], canonical=True, default=encoder_default)
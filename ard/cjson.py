@@ -1,12 +1,22 @@
 
-import collections, binascii
+import collections, binascii, json, re
 from .types import *
+from .transform import *
+from .stats import timed
+from .buffer import BYTES_CLASSES, BASE64_CHUNK_SIZE, MAX_CHUNKS, ChunkEncoder, byte_view, base64_chunks
+from . import json as _json
+from . import lazy
 
 __all__ = (
+  'Reader',
+  'Writer',
   'CJSON_INTEGER_CODE',
   'CJSON_UINTEGER_CODE',
   'CJSON_BYTES_CODE',
   'CJSON_MAP_CODE',
+  'read',
+  'write',
+  'object_pairs_hook',
   'convert_to',
   'convert_from')
 
@@ -15,145 +25,395 @@ CJSON_UINTEGER_CODE = '$ard.uinteger'
 CJSON_BYTES_CODE = '$ard.bytes'
 CJSON_MAP_CODE = '$ard.map'
 
+_CODES = frozenset((CJSON_INTEGER_CODE, CJSON_UINTEGER_CODE, CJSON_BYTES_CODE, CJSON_MAP_CODE))
+_LEAF_CLASSES = frozenset((str, float, bool, type(None)))
 
+# Text that could be (part of) a code or an escape: "$a" and "$$", also when spelled with escapes
+_MARKER = re.compile(r'\$[a$\\]|\\u0024')
+
+_encode_string = json.encoder.encode_basestring
+
+
+class Reader:
+  '''
+  A reusable CJSON reader.
+  '''
+  def __init__(self):
+    self.decoder = json.JSONDecoder(object_pairs_hook=object_pairs_hook)
+    self.plain = _json.Reader()
+
+  def read(self, stream):
+    return self.decode(stream.read())
+
+  def read_all(self, stream):
+    '''
+    Yields the values of a CJSON Lines stream (one value per line) one at a time.
+    Empty lines are ignored.
+    '''
+    for line in stream:
+      if line.strip():
+        yield self.decode(line)
+
+  def decode(self, code):
+    code = _json._text(code)
+    if _has_markers(code):
+      return self.decoder.decode(code)
+    return self.plain.decoder()(code)
+
+
+class Writer:
+  '''
+  A reusable CJSON writer.
+  '''
+  def __init__(self, indent=''):
+    self.indent = indent
+
+  def write(self, value, writer):
+    write(value, writer, self.indent)
+    writer.write('\n')
+
+  def write_all(self, values, writer):
+    '''
+    Writes the values as CJSON Lines (one value per line), batching the writes.
+    Indentation is not supported by CJSON Lines and is ignored.
+    '''
+    encoder = _Encoder(writer, '')
+    for value in values:
+      if _is_plain(value):
+        encoder.chunks.append(_encode_plain(value))
+      else:
+        encoder.encode(value, '')
+      encoder.chunks.append('\n')
+    encoder.flush()
+
+
+def read(stream):
+  '''
+  Reads CJSON in a single pass, decoding it while the JSON is being parsed.
+  The result is identical to that of convert_from(json.load(stream)).
+
+  Text without anything that could be a code is plain JSON, so it is parsed by the current JSON
+  decoding backend (see ard.json.set_backends()) without CJSON decoding.
+  '''
+  code = _json._text(stream.read())
+  if _has_markers(code):
+    return json.loads(code, object_pairs_hook=object_pairs_hook)
+  return _plain.decoder()(code)
+
+def write(value, writer, indent=''):
+  '''
+  Writes the value as CJSON in a single pass, without building an intermediate tree.
+  The output is identical to that of json.dump(convert_to(value), writer, indent=indent).
+
+  Values without anything to encode (only strings, floats, bools, nulls, lists, and dicts with
+  string keys) are written by the json module's C encoder if there is no indentation.
+  '''
+  if (not indent) and _is_plain(value):
+    writer.write(_encode_plain(value))
+    return
+  encoder = _Encoder(writer, indent)
+  encoder.encode(value, '\n' if indent else '')
+  encoder.flush()
+
+def object_pairs_hook(pairs):
+  '''
+  A json object_pairs_hook that decodes CJSON.
+  Because the hook is called for inner objects first, the values we get have already been decoded.
+  '''
+  if len(pairs) == 1:
+    key, value = pairs[0]
+  else:
+    dict_ = dict(pairs)
+    if len(dict_) != 1:
+      return dict_
+    # Duplicate keys (the last one wins, as with convert_from())
+    (key, value), = dict_.items()
+  # Check for codes
+  if key == CJSON_INTEGER_CODE:
+    return int(value)
+  elif key == CJSON_UINTEGER_CODE:
+    return UInteger(value)
+  elif key == CJSON_BYTES_CODE:
+    return binascii.a2b_base64(value)
+  elif key == CJSON_MAP_CODE:
+    map_ = Map()
+    for entry in value:
+      map_[entry['key']] = entry['value']
+    return map_.dict()
+  elif key[:2] == '$$':
+    # Handle escape code:
+    # $$ -> $
+    return {key[1:]: value}
+  return {key: value}
+
+
+def _has_markers(code):
+  if '$' not in code:
+    return '\\u0024' in code
+  return _MARKER.search(code) is not None
+
+def _is_plain(value):
+  # True if the value is plain JSON, which is the same in CJSON
+  stack = [value]
+  while stack:
+    value = stack.pop()
+    class_ = value.__class__
+    if class_ is dict:
+      if len(value) == 1:
+        for key in value:
+          if key in _CODES:
+            # Must be escaped
+            return False
+      for key, value_ in value.items():
+        if key.__class__ is not str:
+          return False
+        if value_.__class__ not in _LEAF_CLASSES:
+          stack.append(value_)
+    elif (class_ is list) or (class_ is tuple):
+      for item in value:
+        if item.__class__ not in _LEAF_CLASSES:
+          stack.append(item)
+    elif class_ not in _LEAF_CLASSES:
+      return False
+  return True
+
+_encode_plain = json.JSONEncoder(ensure_ascii=False).encode
+_plain = _json.Reader()
+_BYTES_KEY = _encode_string(CJSON_BYTES_CODE) + ': "'
+
+class _Encoder(ChunkEncoder):
+  '''
+  Writes JSON tokens to a buffer, which is flushed to the writer when it gets big enough.
+  '''
+
+  __slots__ = ('separator',)
+
+  def __init__(self, writer, indent):
+    super().__init__(writer, indent)
+    self.separator = ',' if indent else ', '
+
+  def encode(self, value, newline):
+    if len(self.chunks) > MAX_CHUNKS:
+      self.flush()
+
+    if isinstance(value, str):
+      self.chunks.append(_encode_string(value))
+
+    elif value is None:
+      self.chunks.append('null')
+
+    elif value is True:
+      self.chunks.append('true')
+
+    elif value is False:
+      self.chunks.append('false')
+
+    elif isinstance(value, UInteger): # must be before checking for 'int'
+      self.encode_object(((CJSON_UINTEGER_CODE, str(value)),), newline)
+
+    elif isinstance(value, int):
+      self.encode_object(((CJSON_INTEGER_CODE, str(value)),), newline)
+
+    elif isinstance(value, float):
+      self.chunks.append(_encode_float(value))
+
+    elif isinstance(value, BYTES_CLASSES):
+      self.encode_bytes(value, newline)
+
+    elif isinstance(value, (lazy.LazyMap, lazy.LazyList)):
+      self.encode(value.materialize(), newline)
+
+    elif isinstance(value, collections.abc.Mapping):
+      if len(value) == 1:
+        # Check if we need escaping
+        for key in value:
+          if isinstance(key, str) and (key in _CODES):
+            self.encode_object((('$'+key, value[key]),), newline)
+            return
+      for key in value:
+        if not isinstance(key, str):
+          self.encode_object(((CJSON_MAP_CODE, _MapEntries(value)),), newline)
+          return
+      self.encode_object(value.items(), newline)
+
+    elif isinstance(value, (list, tuple)):
+      self.encode_array(value, self.encode, newline)
+
+    elif value.__class__ is _MapEntries:
+      self.encode_array(value.map.items(), self.encode_entry, newline)
+
+    else:
+      raise TypeError('cannot serialize type ' + type(value).__name__)
+
+  def encode_bytes(self, value, newline):
+    # Same as encode_object() with the base64 string, which ends with an (escaped) newline
+    chunks = self.chunks
+    view = byte_view(value)
+    large = len(view) > BASE64_CHUNK_SIZE
+    chunks.append('{' + newline + self.indent + _BYTES_KEY)
+    for chunk in base64_chunks(view):
+      chunks.append(chunk)
+      if large:
+        # Written as it is encoded rather than collected whole
+        self.flush()
+    chunks.append('\\n"' + newline + '}')
+
+  def encode_entry(self, entry, newline):
+    key, value = entry
+    self.encode_object((('key', key), ('value', value)), newline)
+
+  def encode_object(self, items, newline):
+    chunks = self.chunks
+    inner_newline = newline + self.indent
+    first = True
+    chunks.append('{')
+    for key, value in items:
+      if first:
+        chunks.append(inner_newline)
+        first = False
+      else:
+        chunks.append(self.separator + inner_newline)
+      chunks.append(_encode_string(key))
+      chunks.append(': ')
+      self.encode(value, inner_newline)
+    chunks.append('}' if first else newline + '}')
+
+  def encode_array(self, items, encode, newline):
+    chunks = self.chunks
+    inner_newline = newline + self.indent
+    first = True
+    chunks.append('[')
+    for value in items:
+      if first:
+        chunks.append(inner_newline)
+        first = False
+      else:
+        chunks.append(self.separator + inner_newline)
+      encode(value, inner_newline)
+    chunks.append(']' if first else newline + ']')
+
+
+class _MapEntries:
+  '''
+  Marks a mapping that must be encoded as a list of key-value entries.
+  '''
+
+  __slots__ = ('map',)
+
+  def __init__(self, map_):
+    self.map = map_
+
+
+def _encode_float(value):
+  # Same as the json module
+  if value != value:
+    return 'NaN'
+  elif value == float('inf'):
+    return 'Infinity'
+  elif value == -float('inf'):
+    return '-Infinity'
+  return float.__repr__(value)
+
+
+@timed('convert_to.cjson')
 def convert_to(value):
-  value, _ = _convert_to(value)
-  return value
+  if _is_plain(value):
+    return value
+  return transform(value, _expand_to, _LEAF_CLASSES)
 
-def _convert_to(value):
-  if isinstance(value, UInteger): # must be before checking for 'int'
-    return {CJSON_UINTEGER_CODE: str(value)}, True
+def _expand_to(value):
+  if isinstance(value, bool): # must be before checking for 'int'
+    return None
+
+  elif isinstance(value, UInteger): # must be before checking for 'int'
+    return None, {CJSON_UINTEGER_CODE: str(value)}
 
   elif isinstance(value, int):
-    return {CJSON_INTEGER_CODE: str(value)}, True
+    return None, {CJSON_INTEGER_CODE: str(value)}
+
+  elif isinstance(value, BYTES_CLASSES):
+    return None, {CJSON_BYTES_CODE: binascii.b2a_base64(byte_view(value)).decode()}
 
-  elif isinstance(value, bytes):
-    return {CJSON_BYTES_CODE: binascii.b2a_base64(value).decode()}, True
+  elif isinstance(value, (lazy.LazyMap, lazy.LazyList)):
+    return None, transform(value.materialize(), _expand_to, _LEAF_CLASSES)
 
   elif isinstance(value, collections.abc.Mapping):
     if len(value) == 1:
       # Check if we need escaping
-      try:
-        value_, _ = _convert_to(value[CJSON_INTEGER_CODE])
-        return {'$'+CJSON_INTEGER_CODE: value_}, True
-      except KeyError:
-        pass
-      try:
-        value_, _ = _convert_to(value[CJSON_UINTEGER_CODE])
-        return {'$'+CJSON_UINTEGER_CODE: value_}, True
-      except KeyError:
-        pass
-      try:
-        value_, _ = _convert_to(value[CJSON_BYTES_CODE])
-        return {'$'+CJSON_BYTES_CODE: value_}, True
-      except KeyError:
-        pass
-      try:
-        value_, _ = _convert_to(value[CJSON_MAP_CODE])
-        return {'$'+CJSON_MAP_CODE: value_}, True
-      except KeyError:
-        pass
-
-    converted = False
-    use_list = False
-    dict_ = {}
-    list_ = []
-    for key in value:
-      value_, value_converted = _convert_to(value[key])
-      if value_converted:
-        converted = True
-      if isinstance(key, str):
-        list_.append({'key': key, 'value': value_})
-        if not use_list:
-          # We can stop building the dict_ if we switched to the list
-          dict_[key] = value_
-      else:
-        key, _ = _convert_to(key)
-        list_.append({'key': key, 'value': value_})
-        use_list = True
-        converted = True
-    if converted:
-      if use_list:
-        return {CJSON_MAP_CODE: list_}, True
-      else:
-        return dict_, True
-    elif isinstance(value, Map):
-      # Maps are not JSON-serializable, so we need the conversion
-      return dict_, True
-
-  elif isinstance(value, (list, tuple)):
-    converted = False
-    list_ = []
-    for value_ in value:
-      value_, value_converted = _convert_to(value_)
-      if value_converted:
-        converted = True
-      list_.append(value_)
-    if converted:
-      if isinstance(value, tuple):
-        return list_, True
-      else:
-        return tuple(list_), True
+      for key in value:
+        if isinstance(key, str) and (key in _CODES):
+          return (value[key],), _build_escaped
+    return items_of(value), _build_to_mapping
 
-  return value, False
+  elif isinstance(value, list):
+    return value, build_list
 
-def convert_from(value):
-  value, _ = _convert_from(value)
+  elif isinstance(value, tuple):
+    return value, build_tuple
+
+  return None
+
+def _build_escaped(value, results, converted):
+  for key in value:
+    return {'$'+key: results[0]}
+
+def _build_to_mapping(value, results, converted):
+  use_list = False
+  for key in value:
+    if not isinstance(key, str):
+      use_list = True
+      break
+  if use_list:
+    return {CJSON_MAP_CODE: [{'key': key, 'value': value_} for key, value_ in pairs_of(results)]}
+  elif converted or isinstance(value, Map):
+    # Maps are not JSON-serializable, so we need the conversion
+    return dict(pairs_of(results))
   return value
 
-def _convert_from(value):
+@timed('convert_from.cjson')
+def convert_from(value):
+  return transform(value, _expand_from, _LEAF_CLASSES)
+
+def _expand_from(value):
   if isinstance(value, collections.abc.Mapping):
     if len(value) == 1:
       # Check for codes
-      try:
-        return int(value[CJSON_INTEGER_CODE]), True
-      except KeyError:
-        try:
-          return UInteger(value[CJSON_UINTEGER_CODE]), True
-        except KeyError:
-          try:
-            return binascii.a2b_base64(value[CJSON_BYTES_CODE]), True
-          except KeyError:
-            try:
-              map_ = value[CJSON_MAP_CODE]
-              map__ = Map()
-              for entry in map_:
-                key, _ = _convert_from(entry['key'])
-                value_, _ = _convert_from(entry['value'])
-                map__[key] = value_
-              return map__.dict(), True
-            except KeyError:
-              # Handle escape code:
-              # $$ -> $
-              for key, value_ in value.items():
-                if key[:2] == '$$':
-                  key = key[1:]
-                  value_, _ = _convert_from(value_)
-                  return {key: value_}, True
-
-    converted = False
-    map_ = Map()
-    for key, value_ in value.items():
-      key, key_converted = _convert_from(key)
-      value_, value_converted = _convert_from(value_)
-      if key_converted or value_converted:
-        converted = True
-      map_[key] = value_
-    if converted:
-      return map_.dict(), True
-
-  elif isinstance(value, (list, tuple)):
-    converted = False
-    list_ = []
-    for value_ in value:
-      value_, value_converted = _convert_from(value_)
-      if value_converted:
-        converted = True
-      list_.append(value_)
-    if converted:
-      if isinstance(value, tuple):
-        return list_, True
-      else:
-        return tuple(list_), True
+      for key, value_ in value.items():
+        if key == CJSON_INTEGER_CODE:
+          return None, int(value_)
+        elif key == CJSON_UINTEGER_CODE:
+          return None, UInteger(value_)
+        elif key == CJSON_BYTES_CODE:
+          return None, binascii.a2b_base64(value_)
+        elif key == CJSON_MAP_CODE:
+          return _entries_of(value_), _build_from_map_code
+        elif isinstance(key, str) and (key[:2] == '$$'):
+          # Handle escape code:
+          # $$ -> $
+          return (value_,), _build_unescaped
+    return items_of(value), _build_from_mapping
+
+  elif isinstance(value, list):
+    return value, build_list
+
+  elif isinstance(value, tuple):
+    return value, build_tuple
+
+  return None
 
-  return value, False
+def _entries_of(entries):
+  for entry in entries:
+    yield entry['key']
+    yield entry['value']
+
+def _build_from_map_code(value, results, converted):
+  return Map(pairs_of(results)).dict()
+
+def _build_unescaped(value, results, converted):
+  for key in value:
+    return {key[1:]: results[0]}
+
+def _build_from_mapping(value, results, converted):
+  if converted:
+    return Map(pairs_of(results)).dict()
+  return value
@@ -0,0 +1,80 @@
+
+import threading
+from .exceptions import *
+from . import yaml, json, cjson, xml, cbor
+
+__all__ = (
+  'reader',
+  'writer',
+  'Pool')
+
+
+def reader(format='yaml'):
+  '''
+  Creates a reusable reader for a format.
+  '''
+  if (format == 'yaml') or (format == ''):
+    return yaml.Reader()
+  elif format == 'json':
+    return json.Reader()
+  elif format == 'cjson':
+    return cjson.Reader()
+  elif format == 'xml':
+    return xml.Reader()
+  elif format == 'cbor':
+    return cbor.Reader()
+  else:
+    raise ARDException('unsupported format: ' + format)
+
+def writer(format='yaml', indent='', strict=False, canonical=False):
+  '''
+  Creates a reusable writer for a format.
+  '''
+  if (format == 'yaml') or (format == ''):
+    return yaml.Writer(indent, strict)
+  elif format == 'json':
+    return json.Writer(indent)
+  elif format == 'cjson':
+    return cjson.Writer(indent)
+  elif format == 'xml':
+    return xml.Writer(indent)
+  elif format == 'cbor':
+    return cbor.Writer(canonical)
+  else:
+    raise ARDException('unsupported format: ' + format)
+
+
+class Pool:
+  '''
+  A thread-local pool of reusable codecs (readers or writers).
+
+  Codecs are keyed by the arguments of the factory that creates them. A codec is removed from the
+  pool while in use, so that nested or interleaved use in the same thread (e.g. from a generator)
+  gets its own codec.
+  '''
+  def __init__(self, factory):
+    self.factory = factory
+    self.local = threading.local()
+
+  def acquire(self, *args):
+    try:
+      codecs = self.local.codecs
+    except AttributeError:
+      codecs = self.local.codecs = {}
+    try:
+      return codecs[args].pop()
+    except (KeyError, IndexError):
+      return self.factory(*args)
+
+  def release(self, codec, *args):
+    try:
+      codecs = self.local.codecs
+    except AttributeError:
+      codecs = self.local.codecs = {}
+    try:
+      codecs[args].append(codec)
+    except KeyError:
+      codecs[args] = [codec]
+
+readers = Pool(reader)
+writers = Pool(writer)
@@ -2,6 +2,7 @@
 import io, binascii
 from .read import *
 from .exceptions import *
+from . import lazy
 
 __all__ = (
   'decode',
@@ -9,10 +10,16 @@ __all__ = (
   'decode_json',
   'decode_cjson',
   'decode_xml',
-  'decode_cbor')
+  'decode_cbor',
+  'decode_cbor_bytes',
+  'decode_cbor_lazy')
 
 
 def decode(code, format='yaml'):
+  '''
+  The code can be a str or a bytes-like object (bytes, bytearray, memoryview).
+  Binary text formats are expected to be in UTF-8. Binary CBOR is raw, while a str is base64.
+  '''
   if (format == 'yaml') or (format == ''):
     return decode_yaml(code)
   elif format == 'json':
@@ -27,17 +34,40 @@ def decode(code, format='yaml'):
     raise ARDException('unsupported format: ' + format)
 
 def decode_yaml(code):
-  return read_yaml(io.StringIO(code))
+  return read_yaml(io.StringIO(_text(code)))
 
 def decode_json(code):
-  return read_json(io.StringIO(code))
+  return read_json(io.StringIO(_text(code)))
 
 def decode_cjson(code):
-  return read_cjson(io.StringIO(code))
+  return read_cjson(io.StringIO(_text(code)))
 
 def decode_xml(code):
-  return read_xml(io.StringIO(code))
+  return read_xml(io.StringIO(_text(code)))
 
 def decode_cbor(code):
-  bytes_ = binascii.a2b_base64(code)
-  return read_cbor(io.BytesIO(bytes_))
+  if isinstance(code, str):
+    code = binascii.a2b_base64(code)
+  return decode_cbor_bytes(code)
+
+def decode_cbor_bytes(code):
+  '''
+  Decodes raw CBOR from a bytes-like object.
+  bytes (and memoryviews of entire bytes) are read in place without copying.
+  '''
+  if isinstance(code, memoryview) and isinstance(code.obj, bytes) and (code.nbytes == len(code.obj)):
+    code = code.obj
+  return read_cbor(io.BytesIO(code))
+
+def decode_cbor_lazy(code, memoryviews=False):
+  '''
+  Decodes raw CBOR from a bytes-like object lazily: maps and arrays become LazyMaps and LazyLists,
+  which decode their contents only when accessed. If memoryviews is True then byte strings are
+  memoryviews into the code. See ard.lazy.load().
+  '''
+  return lazy.load(code, memoryviews)
+
+def _text(code):
+  if isinstance(code, str):
+    return code
+  return str(code, 'utf-8')
@@ -0,0 +1,36 @@
+
+import hashlib
+from .types import *
+from .encode import *
+
+__all__ = (
+  'digest',
+  'digest_bytes')
+
+
+def digest(value):
+  '''
+  A canonical digest of the content of the value (a SHA-256 hex string), e.g. for change detection.
+
+  Values that are equal have the same digest: mappings (including Maps, and Maps with complex keys)
+  regardless of their insertion order, and lists and tuples regardless of their type. Unlike
+  equality, bool, int, and float values are distinguished (as they are by all formats), e.g. 1 and
+  1.0 have different digests.
+
+  The value is hashed in its canonical CBOR form, so this is the same as
+  digest_bytes(encode_cbor_bytes(value, canonical=True)). The digests of deeply immutable Maps (as
+  returned by freeze()) are cached.
+  '''
+  if isinstance(value, Map) and value._deep:
+    if value._digest is None:
+      value._digest = digest_bytes(encode_cbor_bytes(value, True))
+    return value._digest
+  return digest_bytes(encode_cbor_bytes(value, True))
+
+def digest_bytes(code):
+  '''
+  The digest of encoded content (a bytes-like object), e.g. for keying caches on CBOR that was
+  received in canonical form without decoding it. For canonical CBOR it is the same as the digest()
+  of the decoded value.
+  '''
+  return hashlib.sha256(code).hexdigest()
@@ -9,22 +9,29 @@ __all__ = (
   'encode_json',
   'encode_cjson',
   'encode_xml',
-  'encode_cbor')
+  'encode_cbor',
+  'encode_cbor_bytes')
 
 
-def encode(value, format='yaml', indent='', strict=False):
+def encode(value, format='yaml', indent='', strict=False, binary=False, canonical=False):
+  '''
+  If binary is True the code is returned as bytes: UTF-8 for text formats and raw CBOR.
+  Otherwise it is returned as a str, with CBOR in base64.
+  If canonical is True then CBOR is deterministically encoded (see write_cbor()).
+  '''
   if (format == 'yaml') or (format == ''):
-    return encode_yaml(value, indent, strict)
+    code = encode_yaml(value, indent, strict)
   elif format == 'json':
-    return encode_json(value, indent)
+    code = encode_json(value, indent)
   elif format == 'cjson':
-    return encode_cjson(value, indent)
+    code = encode_cjson(value, indent)
   elif format == 'xml':
-    return encode_xml(value, indent)
+    code = encode_xml(value, indent)
   elif format == 'cbor':
-    return encode_cbor(value)
+    return encode_cbor_bytes(value, canonical) if binary else encode_cbor(value, canonical)
   else:
     raise ARDException('unsupported format: ' + format)
+  return code.encode('utf-8') if binary else code
 
 def encode_yaml(value, indent='', strict=False):
   buffer = io.StringIO()
@@ -46,7 +53,13 @@ def encode_xml(value, indent=''):
   write_xml(value, buffer, indent)
   return buffer.getvalue()
 
-def encode_cbor(value):
+def encode_cbor(value, canonical=False):
+  return binascii.b2a_base64(encode_cbor_bytes(value, canonical)).decode()
+
+def encode_cbor_bytes(value, canonical=False):
+  '''
+  Encodes as raw CBOR bytes.
+  '''
   buffer = io.BytesIO()
-  write_cbor(value, buffer)
-  return binascii.b2a_base64(buffer.getvalue()).decode()
+  write_cbor(value, buffer, canonical)
+  return buffer.getvalue()
@@ -0,0 +1,212 @@
+
+import collections.abc, json, re
+from .exceptions import *
+from .read import *
+from . import cjson, lazy
+
+__all__ = (
+  'extract',)
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_SCALAR = re.compile(r'[^,:\[\]{}\s]*')
+_PLAIN = json.JSONDecoder()
+# Characters that can be escaped in JSON strings other than with \u
+_ESCAPABLE = re.compile(r'["\\/\x00-\x1f]')
+
+
+def extract(stream, format='yaml', paths=(), default=None):
+  '''
+  Reads only the values at the paths, returning them as a list in the same order. Paths are
+  sequences of map keys (which can be complex) and list indexes. The default is returned for paths
+  that do not exist.
+
+  The whole document is read into memory first; this is not a streaming parser. For JSON and CJSON
+  the document is then navigated by a scanner: the maps and lists along the paths are scanned, but the
+  containers they skip over are parsed by the json module's C decoder and discarded, which is faster
+  than scanning them in Python. Thus CJSON decoding is applied only to the extracted values, but the
+  cost of skipping still grows with the size of what is skipped. For CBOR the document is read lazily
+  (see ard.lazy). Other formats are fully decoded first.
+
+  As when decoding, the last of duplicate keys wins. Note that the skipped parts are not necessarily
+  validated.
+  '''
+  if format in ('json', 'cjson'):
+    code = stream.read()
+    if not isinstance(code, str):
+      code = str(code, 'utf-8')
+    try:
+      scanner = _Scanner(code, format == 'cjson')
+      return [scanner.extract(path, default) for path in paths]
+    except Exception as e:
+      raise DecodeError(format) from e
+  elif format == 'cbor':
+    root = lazy.load(stream.read())
+  else:
+    root = read(stream, format)
+  return [_extract(root, path, default) for path in paths]
+
+def _extract(value, path, default):
+  for step in path:
+    if isinstance(value, collections.abc.Mapping):
+      try:
+        value = value[step]
+      except (KeyError, TypeError):
+        return default
+    elif isinstance(value, (list, tuple, lazy.LazyList)) and isinstance(step, int) and not isinstance(step, bool):
+      try:
+        value = value[step]
+      except IndexError:
+        return default
+    else:
+      return default
+  if isinstance(value, (lazy.LazyMap, lazy.LazyList)):
+    return value.materialize()
+  return value
+
+
+class _Scanner:
+  '''
+  Navigates JSON text by skipping over values.
+  '''
+  def __init__(self, code, cjson_):
+    self.code = code
+    self.cjson = cjson_
+    self.decoder = json.JSONDecoder(object_pairs_hook=cjson.object_pairs_hook) if cjson_ else json.JSONDecoder()
+
+  def extract(self, path, default):
+    offset = self.whitespace(0)
+    for step in path:
+      offset = self.find(offset, step)
+      if offset is None:
+        return default
+    value, _ = self.decoder.raw_decode(self.code, offset)
+    return value
+
+  def find(self, offset, step):
+    # Returns the offset of the child at the step, or None
+    character = self.code[offset]
+    if character == '{':
+      if self.cjson:
+        return self.find_in_cjson_object(offset, step)
+      if isinstance(step, str):
+        # The last duplicate key wins, as when decoding
+        found = None
+        for key, start in self.entries(offset):
+          if key == step:
+            if self.last(start, step):
+              return start
+            found = start
+        return found
+    elif character == '[':
+      if isinstance(step, int) and not isinstance(step, bool):
+        if step < 0:
+          items = list(self.items(offset))
+          return items[step] if -step <= len(items) else None
+        for index, start in enumerate(self.items(offset)):
+          if index == step:
+            return start
+    return None
+
+  def find_in_cjson_object(self, offset, step):
+    # Must be consistent with cjson.object_pairs_hook: codes and escapes apply to single-entry objects
+    count = 0
+    first = None
+    found = None
+    for key, start in self.entries(offset):
+      count += 1
+      if count == 1:
+        first = key, start
+      if key == step:
+        if (key[:1] != '$') and self.last(start, step):
+          return start
+        # The last duplicate key wins, as when decoding
+        found = start
+    if count == 1:
+      key, start = first
+      if key == cjson.CJSON_MAP_CODE:
+        return self.find_in_cjson_map(start, step)
+      elif key in cjson._CODES:
+        return None
+      elif key[:2] == '$$':
+        return start if key[1:] == step else None
+    return found
+
+  def find_in_cjson_map(self, offset, step):
+    found = None
+    for entry in self.items(offset):
+      key = value = None
+      for name, start in self.entries(entry):
+        if name == 'key':
+          key = start
+        elif name == 'value':
+          value = start
+      if (key is not None) and (value is not None):
+        key, _ = self.decoder.raw_decode(self.code, key)
+        if key == step:
+          # The last entry wins, as when decoding
+          found = value
+    return found
+
+  def last(self, offset, key):
+    # True if the key cannot appear again after the offset (at any depth), so that there is no need to
+    # look for a duplicate in the rest of the object
+    if _ESCAPABLE.search(key) is not None:
+      return False
+    code = self.code
+    return (code.find('"' + key + '"', offset) == -1) and (code.find('\\u', offset) == -1)
+
+  def entries(self, offset):
+    # Yields the keys and value offsets of an object, skipping over the values
+    code = self.code
+    offset = self.whitespace(offset + 1)
+    if code[offset] == '}':
+      return
+    while True:
+      key, offset = json.decoder.scanstring(code, offset + 1)
+      offset = self.whitespace(offset)
+      if code[offset] != ':':
+        raise ValueError('expected ":" at {}'.format(offset))
+      start = self.whitespace(offset + 1)
+      yield key, start
+      offset = self.whitespace(self.skip(start))
+      character = code[offset]
+      if character == '}':
+        return
+      elif character != ',':
+        raise ValueError('expected "," or "}}" at {}'.format(offset))
+      offset = self.whitespace(offset + 1)
+
+  def items(self, offset):
+    # Yields the offsets of the items of an array, skipping over them
+    code = self.code
+    offset = self.whitespace(offset + 1)
+    if code[offset] == ']':
+      return
+    while True:
+      yield offset
+      offset = self.whitespace(self.skip(offset))
+      character = code[offset]
+      if character == ']':
+        return
+      elif character != ',':
+        raise ValueError('expected "," or "]" at {}'.format(offset))
+      offset = self.whitespace(offset + 1)
+
+  def skip(self, offset):
+    # Returns the offset after the value
+    code = self.code
+    character = code[offset]
+    if character == '"':
+      return _STRING.match(code, offset).end()
+    elif (character == '{') or (character == '['):
+      # The json module's C scanner is much faster than we can be in Python, even though it builds
+      # (and discards) the values
+      return _PLAIN.raw_decode(code, offset)[1]
+    end = _SCALAR.match(code, offset).end()
+    if end == offset:
+      raise ValueError('expected a value at {}'.format(offset))
+    return end
+
+  def whitespace(self, offset):
+    return _WHITESPACE.match(self.code, offset).end()
@@ -0,0 +1,156 @@
+
+import collections.abc
+from .types import *
+from .types import _SIMPLE_KEY_TYPES, _deeply_frozen_map
+from .transform import *
+from . import lazy
+
+__all__ = (
+  'freeze',
+  'evolve')
+
+_LEAF_CLASSES = frozenset((str, int, float, bool, bytes, type(None), UInteger))
+
+
+def freeze(value):
+  '''
+  Returns a deeply immutable and hashable version of the value: mappings become frozen Maps, lists
+  become tuples, and bytearrays and memoryviews become bytes. Mappings in map keys become frozen Maps,
+  too, but lists in keys are kept as lists, because turning them into tuples would change how keys
+  are looked up. Thus list keys (and lists within keys) are the one part that remains mutable.
+
+  Parts that are already immutable are used as is rather than copied, and Maps returned by freeze()
+  are not visited again, so freezing a frozen value is cheap and returns it unchanged. Frozen values
+  can be safely shared between threads.
+  '''
+  return transform(value, _expand, _LEAF_CLASSES)
+
+def evolve(value, path, new_value=None, delete=False):
+  '''
+  Returns a frozen version of the value in which the item at the path is replaced with new_value (or
+  deleted if delete is True), without modifying the value.
+
+  As with extract(), the path is a sequence of map keys (which can be complex) and list indexes. A
+  missing map key is added. The value is frozen first (see freeze()), and then only the mappings
+  and sequences along the path are copied, one level each, while everything else is shared. Thus
+  evolving a Map returned by freeze() or evolve() costs only as much as the copies.
+  '''
+  value = freeze(value)
+  path = tuple(path)
+  if not path:
+    if delete:
+      raise ValueError('cannot delete the root')
+    return freeze(new_value)
+
+  # The containers along the path
+  nodes = [value]
+  for step in path[:-1]:
+    nodes.append(nodes[-1][step])
+
+  if not delete:
+    new_value = freeze(new_value)
+  for node, step in zip(reversed(nodes), reversed(path)):
+    new_value = _replace(node, step, new_value, delete)
+    delete = False
+  return new_value
+
+def _replace(node, step, new_value, delete):
+  # The node and the new value are frozen, so the copy is, too
+  if isinstance(node, Map):
+    map_ = node.copy()
+    if delete:
+      del map_[step]
+    else:
+      map_[_freeze_key(step)] = new_value
+    return _deeply_frozen_map(map_._dict, map_._complex)
+  elif isinstance(node, tuple):
+    items = list(node)
+    if delete:
+      del items[step]
+    else:
+      items[step] = new_value
+    return tuple(items)
+  raise TypeError('cannot evolve type ' + type(node).__name__)
+
+def _expand(value):
+  class_ = value.__class__
+  if class_ is dict:
+    values = value.values()
+    for value_ in values:
+      if value_.__class__ not in _LEAF_CLASSES:
+        return values, _build_map
+    # Shortcut for dicts of leaves
+    return None, _build_map(value, values, False)
+
+  elif class_ is list:
+    for item in value:
+      if item.__class__ not in _LEAF_CLASSES:
+        return value, _build_tuple
+    # Shortcut for lists of leaves
+    return None, tuple(value)
+
+  elif isinstance(value, Map):
+    if value._deep:
+      return None
+    return value.values(), _build_map
+
+  elif isinstance(value, (lazy.LazyMap, lazy.LazyList)):
+    return None, freeze(value.materialize())
+
+  elif isinstance(value, collections.abc.Mapping):
+    return value.values(), _build_map
+
+  elif isinstance(value, list):
+    return value, _build_tuple
+
+  elif isinstance(value, tuple):
+    return value, build_tuple
+
+  elif isinstance(value, (bytearray, memoryview)):
+    return None, bytes(value)
+
+  return None
+
+def _build_map(value, results, converted):
+  if isinstance(value, Map):
+    if value._complex is None:
+      # Hashable keys (without mappings in them) are already frozen
+      return _deeply_frozen_map(dict(zip(value._dict, results)))
+  else:
+    keys = value.keys()
+    for key in keys:
+      if key.__class__ not in _SIMPLE_KEY_TYPES:
+        break
+    else:
+      return _deeply_frozen_map(dict(zip(keys, results)))
+  map_ = Map(zip(map(_freeze_key, value.keys()), results))
+  return _deeply_frozen_map(map_._dict, map_._complex)
+
+def _build_tuple(value, results, converted):
+  return tuple(results)
+
+# Keys
+#
+# Frozen keys must compare equal to the originals and have the same fingerprints, so mappings become
+# frozen Maps, but lists stay lists (tuples are compared and fingerprinted differently).
+
+def _freeze_key(key):
+  if key.__class__ in _SIMPLE_KEY_TYPES:
+    return key
+  return transform(key, _expand_key, _SIMPLE_KEY_TYPES)
+
+def _expand_key(value):
+  if isinstance(value, collections.abc.Mapping):
+    return items_of(value), _build_key_map
+  elif isinstance(value, list):
+    return value, build_list
+  elif isinstance(value, tuple):
+    return value, build_tuple
+  return None
+
+def _build_key_map(value, results, converted):
+  if (not converted) and isinstance(value, Map) and (not value._mutable):
+    return value
+  map_ = Map(pairs_of(results))
+  map_.freeze()
+  return map_
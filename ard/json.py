@@ -1,8 +1,90 @@
 
-import json
+import json, math, re
 from .types import *
+from .buffer import *
+from . import lazy
 
-__all__ = ('Encoder',)
+__all__ = (
+  'Reader',
+  'Writer',
+  'Encoder',
+  'Backend',
+  'BACKENDS',
+  'get_backends',
+  'set_backends')
+
+# orjson parses integers beyond 64 bits as floats, so text with such digit runs is not given to it
+# (this also catches some integers that would fit, which is harmless)
+_LONG_INTEGER = re.compile(r'[0-9]{19}')
+
+
+class Reader:
+  '''
+  A reusable JSON reader.
+
+  Uses the given backend, or else follows the current default decoding backend.
+  '''
+  def __init__(self, backend=None):
+    self.backend = backend
+    self._backend = None
+    self._decode = None
+
+  def read(self, stream):
+    return self.decoder()(_text(stream.read()))
+
+  def read_all(self, stream):
+    '''
+    Yields the values of a JSON Lines stream (one value per line) one at a time.
+    Empty lines are ignored.
+    '''
+    decode = self.decoder()
+    for line in stream:
+      if line.strip():
+        yield decode(_text(line))
+
+  def decoder(self):
+    backend = self.backend or _decoding
+    if backend is not self._backend:
+      self._decode = backend.decoder()
+      self._backend = backend
+    return self._decode
+
+
+class Writer:
+  '''
+  A reusable JSON writer.
+
+  Uses the given backend, or else follows the current default encoding backend.
+  '''
+  def __init__(self, indent='', backend=None):
+    self.indent = indent
+    self.backend = backend
+    self._backend = None
+    self._encode = None
+
+  def write(self, value, writer):
+    writer.write(self.encoder()(value))
+    writer.write('\n')
+
+  def write_all(self, values, writer):
+    '''
+    Writes the values as JSON Lines (one value per line), batching the writes.
+    Indentation is not supported by JSON Lines and is ignored.
+    '''
+    encode = (self.backend or _encoding).encoder('')
+    buffer = Buffer(writer)
+    for value in values:
+      buffer.stream.write(encode(value))
+      buffer.stream.write('\n')
+      buffer.drain()
+    buffer.drain(True)
+
+  def encoder(self):
+    backend = self.backend or _encoding
+    if backend is not self._backend:
+      self._encode = backend.encoder(self.indent)
+      self._backend = backend
+    return self._encode
 
 
 class Encoder(json.JSONEncoder):
@@ -10,9 +92,207 @@ class Encoder(json.JSONEncoder):
   A JSONEncoder that supports the Map class.
   '''
   def default(self, obj):
-    if isinstance(obj, Map):
+    return default(obj)
+
+
+def default(obj):
+  '''
+  Converts a Map to a dict, or to a list of (key, value) items if it has keys that JSON does not
+  support. Lazy proxies (see ard.lazy) are fully decoded.
+  '''
+  if isinstance(obj, (lazy.LazyMap, lazy.LazyList)):
+    return obj.materialize()
+  if isinstance(obj, Map):
+    try:
+      return obj.dict(strict=True, json=True)
+    except TypeError:
+      return list(obj.items())
+  raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class Backend:
+  '''
+  A JSON implementation.
+
+  decoder() returns a function that decodes a str. encoder(indent) returns a function that encodes
+  a value to a str.
+  '''
+  name = None
+
+  def decoder(self):
+    raise NotImplementedError()
+
+  def encoder(self, indent=''):
+    raise NotImplementedError()
+
+
+class StandardBackend(Backend):
+  '''
+  The standard json module.
+  '''
+  name = 'json'
+
+  def decoder(self):
+    return json.JSONDecoder().decode
+
+  def encoder(self, indent=''):
+    return Encoder(ensure_ascii=False, indent=indent or None).encode
+
+
+class OrjsonBackend(Backend):
+  '''
+  The orjson library.
+
+  Falls back to the standard json module for what it does not support the same way: integers
+  beyond 64 bits, NaN and Infinity (which orjson would encode as null), and indentation other than 2
+  spaces. Note that its output is more compact ('{"a":1}' rather than '{"a": 1}').
+
+  Because orjson decodes integers beyond 64 bits as floats, the text is first scanned for long
+  digit runs, which costs more than orjson saves for number-heavy documents.
+  '''
+  name = 'orjson'
+
+  def __init__(self):
+    import orjson
+    self.orjson = orjson
+
+  def decoder(self):
+    loads = self.orjson.loads
+    error = self.orjson.JSONDecodeError
+    fallback = _standard.decoder()
+
+    def decode(code):
+      if _LONG_INTEGER.search(code) is None:
+        try:
+          return loads(code)
+        except error:
+          pass
+      return fallback(code)
+
+    return decode
+
+  def encoder(self, indent=''):
+    if indent == '':
+      option = self.orjson.OPT_NON_STR_KEYS
+    elif indent == '  ':
+      option = self.orjson.OPT_NON_STR_KEYS | self.orjson.OPT_INDENT_2
+    else:
+      return _standard.encoder(indent)
+    dumps = self.orjson.dumps
+    error = self.orjson.JSONEncodeError
+    fallback = _standard.encoder(indent)
+
+    def encode(value):
+      try:
+        code = dumps(value, default=default, option=option)
+      except error:
+        return fallback(value)
+      if (b'null' in code) and _has_non_finite(value):
+        return fallback(value)
+      return code.decode('utf-8')
+
+    return encode
+
+
+class UjsonBackend(Backend):
+  '''
+  The ujson library.
+
+  Falls back to the standard json module for indentation that is not made of spaces. Note that its
+  output is more compact ('{"a":1}' rather than '{"a": 1}'), and that its decoder is lenient: it
+  accepts some malformed JSON (e.g. "-" and "01" as numbers, and control characters in strings)
+  rather than raising an error.
+  '''
+  name = 'ujson'
+
+  def __init__(self):
+    import ujson
+    self.ujson = ujson
+
+  def decoder(self):
+    loads = self.ujson.loads
+    error = self.ujson.JSONDecodeError
+    fallback = _standard.decoder()
+
+    def decode(code):
       try:
-        return obj.dict(strict=True, json=True)
-      except TypeError:
-        return obj._items
-    return super().default(self, obj)
+        return loads(code)
+      except error:
+        return fallback(code)
+
+    return decode
+
+  def encoder(self, indent=''):
+    if indent.strip(' '):
+      return _standard.encoder(indent)
+    dumps = self.ujson.dumps
+    fallback = _standard.encoder(indent)
+    indent = len(indent)
+
+    def encode(value):
+      try:
+        return dumps(value, ensure_ascii=False, escape_forward_slashes=False, indent=indent, default=default)
+      except (TypeError, OverflowError):
+        return fallback(value)
+
+    return encode
+
+
+BACKENDS = {
+  'json': StandardBackend,
+  'orjson': OrjsonBackend,
+  'ujson': UjsonBackend}
+
+def get_backends():
+  '''
+  Returns the current default (decoding, encoding) backends.
+  '''
+  return _decoding, _encoding
+
+def set_backends(decoding=None, encoding=None):
+  '''
+  Sets the default backends by name ("json", "orjson", or "ujson"). They are used by all readers and
+  writers that were not given a backend.
+
+  None means the standard json module, which is the default. The other libraries are faster, but do
+  not give exactly the same results (see OrjsonBackend and UjsonBackend), so they are used only if
+  selected.
+  '''
+  global _decoding, _encoding
+  _decoding = _new_backend(decoding)
+  _encoding = _new_backend(encoding)
+  return _decoding, _encoding
+
+def _new_backend(name):
+  if (name is None) or (name == 'json'):
+    return _standard
+  try:
+    backend = BACKENDS[name]
+  except KeyError:
+    raise ValueError('unsupported JSON backend: ' + name)
+  return backend()
+
+def _text(code):
+  # Like json.loads(), we also accept UTF-8, UTF-16, or UTF-32 bytes (e.g. from binary streams)
+  if isinstance(code, str):
+    return code
+  code = bytes(code)
+  return code.decode(json.detect_encoding(code), 'surrogatepass')
+
+def _has_non_finite(value):
+  # True if there is a NaN or Infinity anywhere in the value
+  stack = [value]
+  while stack:
+    value = stack.pop()
+    if isinstance(value, float):
+      if not math.isfinite(value):
+        return True
+    elif isinstance(value, (dict, Map)):
+      stack.extend(value.keys())
+      stack.extend(value.values())
+    elif isinstance(value, (list, tuple)):
+      stack.extend(value)
+  return False
+
+_standard = StandardBackend()
+_decoding = _encoding = _standard
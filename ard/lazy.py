@@ -0,0 +1,398 @@
+
+import collections.abc, io, struct, cbor2
+from .types import *
+from .exceptions import *
+from .buffer import byte_view
+from . import cbor
+
+__all__ = (
+  'LazyMap',
+  'LazyList',
+  'load',
+  'read_header',
+  'skip_item')
+
+_BREAK = 0xff
+# The sizes of CBOR heads by additional information (the rest are 1)
+_HEAD_SIZES = {24: 2, 25: 3, 26: 5, 27: 9}
+_MISSING = object()
+_UNDECODED = object()
+
+
+class LazyMap(collections.abc.Mapping):
+  '''
+  A read-only Map-like proxy for a CBOR map in a document.
+
+  Entries are indexed as far as needed to find a key, and values are decoded only when accessed. Map
+  and array values become LazyMaps and LazyLists in turn. Call materialize() for a regular, fully
+  decoded value.
+
+  Note that for duplicate keys (which are invalid CBOR) a lookup may find the first one, while full
+  decoding keeps the last one.
+  '''
+
+  __slots__ = ('_document', '_start', '_index', '_values', '_scanner')
+
+  def __init__(self, document, start):
+    self._document = document
+    self._start = start
+    # Maps the keys to the offsets of the values
+    self._index = Map()
+    self._values = {}
+    self._scanner = document.children(start)
+
+  def materialize(self):
+    return self._document.decode(self._start)
+
+  def __getitem__(self, key):
+    try:
+      start = self._index[key]
+    except KeyError:
+      if not self._scan(key):
+        raise
+      start = self._index[key]
+    try:
+      return self._values[start]
+    except KeyError:
+      value = self._values[start] = self._document.value(start)
+      return value
+
+  def __contains__(self, key):
+    return (key in self._index) or self._scan(key)
+
+  def __iter__(self):
+    self._scan()
+    return iter(self._index)
+
+  def __len__(self):
+    self._scan()
+    return len(self._index)
+
+  def __eq__(self, other):
+    if isinstance(other, LazyMap):
+      other = other.materialize()
+    return self.materialize() == other
+
+  def __repr__(self):
+    return 'LazyMap(' + repr(self.materialize()) + ')'
+
+  def _scan(self, key=_MISSING):
+    # Indexes more entries until the key is found (or all entries if no key), returning True if found
+    scanner = self._scanner
+    if scanner is None:
+      return False
+    document = self._document
+    try:
+      for key_offset in scanner:
+        value_offset = next(scanner)
+        key_ = document.key(key_offset, value_offset)
+        self._index[key_] = value_offset
+        if (key is not _MISSING) and (key_ == key):
+          return True
+    except Exception as e:
+      raise DecodeError('cbor') from e
+    self._scanner = None
+    return False
+
+
+class LazyList(collections.abc.Sequence):
+  '''
+  A read-only list-like proxy for a CBOR array in a document.
+
+  Items are located as far as needed and decoded only when accessed. Map and array items become
+  LazyMaps and LazyLists in turn. Call materialize() for a regular, fully decoded value.
+  '''
+
+  __slots__ = ('_document', '_start', '_offsets', '_items', '_scanner')
+
+  def __init__(self, document, start):
+    self._document = document
+    self._start = start
+    self._offsets = []
+    self._items = []
+    self._scanner = document.children(start)
+
+  def materialize(self):
+    return self._document.decode(self._start)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[index_] for index_ in range(*index.indices(len(self)))]
+    if index < 0:
+      self._scan()
+    elif index >= len(self._offsets):
+      self._scan(index)
+    item = self._items[index]
+    if item is _UNDECODED:
+      item = self._items[index] = self._document.value(self._offsets[index])
+    return item
+
+  def __iter__(self):
+    index = 0
+    while True:
+      try:
+        yield self[index]
+      except IndexError:
+        return
+      index += 1
+
+  def __len__(self):
+    self._scan()
+    return len(self._offsets)
+
+  def __eq__(self, other):
+    if isinstance(other, LazyList):
+      other = other.materialize()
+    return self.materialize() == other
+
+  def __repr__(self):
+    return 'LazyList(' + repr(self.materialize()) + ')'
+
+  def _scan(self, index=None):
+    # Locates more items until the index (or all items if no index)
+    scanner = self._scanner
+    if scanner is None:
+      return
+    try:
+      for offset in scanner:
+        self._offsets.append(offset)
+        self._items.append(_UNDECODED)
+        if (index is not None) and (index < len(self._offsets)):
+          return
+    except Exception as e:
+      raise DecodeError('cbor') from e
+    self._scanner = None
+
+
+def load(code, memoryviews=False):
+  '''
+  Lazily decodes raw CBOR from a bytes-like object. bytes (and memoryviews of entire bytes) are
+  used in place, while other bytes-like objects are copied once.
+
+  If memoryviews is True then byte strings that are accessed through the proxies are memoryviews
+  into the code rather than copies, and the code is never copied (it must not be modified while
+  the views are in use). Byte strings in map keys and in fully decoded values are still bytes.
+
+  A top-level map or array becomes a LazyMap or LazyList. Other values are decoded as usual. The
+  proxies can be given to all writers (and to freeze() and digest()), which fully decode them.
+
+  Locating the entries of a map or array requires skipping over the preceding ones, which is done
+  without converting them, so the cost depends on what is accessed and where it is in the document.
+  Not thread-safe. CBOR value sharing and string references (tags 28, 29, and 256) are not
+  supported.
+  '''
+  return _Document(code, memoryviews).value(0)
+
+def read_header(buffer, offset):
+  '''
+  Reads the head of the CBOR data item at the offset.
+  Returns (major type, additional information, argument, offset after the head). The argument is
+  None for indefinite lengths.
+  '''
+  initial = buffer[offset]
+  major = initial >> 5
+  info = initial & 0x1f
+  offset += 1
+  if info < 24:
+    return major, info, info, offset
+  elif info == 24:
+    return major, info, buffer[offset], offset + 1
+  elif info == 25:
+    return major, info, int.from_bytes(buffer[offset:offset + 2], 'big'), offset + 2
+  elif info == 26:
+    return major, info, int.from_bytes(buffer[offset:offset + 4], 'big'), offset + 4
+  elif info == 27:
+    return major, info, int.from_bytes(buffer[offset:offset + 8], 'big'), offset + 8
+  elif (info == 31) and (major in (2, 3, 4, 5, 7)):
+    return major, info, None, offset
+  raise ValueError('invalid CBOR additional information: {} at {}'.format(info, offset - 1))
+
+def skip_item(buffer, offset):
+  '''
+  Returns the offset after the CBOR data item at the offset, without decoding it.
+  '''
+  # The number of data items left to skip at each level of nesting, or -1 for indefinite lengths
+  pending = [1]
+  offset = _scan_item(buffer, offset, pending)
+  if pending or (offset > len(buffer)):
+    raise ValueError('truncated CBOR')
+  return offset
+
+def _scan_item(buffer, offset, pending):
+  # Skips as much of a CBOR data item as the buffer holds, updating pending (see skip_item()) in
+  # place, so that the scan can be resumed once the buffer has grown. Returns the offset reached,
+  # which is beyond the end of the buffer if a string in it is incomplete.
+  length = len(buffer)
+  while pending:
+    left = pending[-1]
+    if left == 0:
+      pending.pop()
+      continue
+    if offset >= length:
+      break
+    if (left < 0) and (buffer[offset] == _BREAK):
+      offset += 1
+      pending.pop()
+      continue
+    if offset + _HEAD_SIZES.get(buffer[offset] & 0x1f, 1) > length:
+      break
+    if left > 0:
+      pending[-1] = left - 1
+
+    major, info, argument, offset = read_header(buffer, offset)
+    if (major == 2) or (major == 3):
+      if argument is None:
+        # Indefinite-length strings are made of chunks
+        pending.append(-1)
+      else:
+        offset += argument
+    elif major == 4:
+      pending.append(-1 if argument is None else argument)
+    elif major == 5:
+      pending.append(-1 if argument is None else argument * 2)
+    elif major == 6:
+      # The tag content
+      pending.append(1)
+    elif (major == 7) and (argument is None):
+      raise ValueError('unexpected CBOR break at {}'.format(offset - 1))
+  return offset
+
+
+class _Document:
+  '''
+  The buffer shared by the lazy proxies of a document.
+
+  Containers are skipped by cbor2's decoder, which is much faster than skip_item() is in Python, even
+  though it builds (and discards) the values.
+  '''
+
+  __slots__ = ('buffer', 'stream', 'skipper', 'decoder')
+
+  def __init__(self, code, memoryviews=False):
+    if isinstance(code, memoryview) and isinstance(code.obj, bytes) and (code.nbytes == len(code.obj)):
+      code = code.obj
+    if isinstance(code, bytes):
+      # BytesIO shares the bytes rather than copying them
+      self.stream = io.BytesIO(code)
+      self.buffer = memoryview(code) if memoryviews else code
+    elif memoryviews:
+      self.buffer = byte_view(code)
+      self.stream = _ViewStream(self.buffer)
+    else:
+      code = bytes(code)
+      self.stream = io.BytesIO(code)
+      self.buffer = code
+    self.skipper = cbor2.CBORDecoder(self.stream)
+    self.decoder = cbor2.CBORDecoder(self.stream, object_hook=cbor.object_hook)
+
+  def skip(self, offset):
+    major, _, argument, end = read_header(self.buffer, offset)
+    if (major < 2) or ((major == 7) and (argument is not None)):
+      return end
+    elif (major < 4) and (argument is not None):
+      return end + argument
+    self.stream.seek(offset)
+    self.skipper.decode()
+    return self.stream.tell()
+
+  def children(self, offset):
+    # Yields the offsets of the data items in an array or map (keys and values, alternating)
+    buffer = self.buffer
+    major, _, count, offset = read_header(buffer, offset)
+    if count is None:
+      while buffer[offset] != _BREAK:
+        yield offset
+        offset = self.skip(offset)
+    else:
+      if major == 5:
+        count *= 2
+      for _ in range(count):
+        yield offset
+        offset = self.skip(offset)
+
+  def value(self, start):
+    # Decodes the data item at the offset, lazily if it is a map or an array
+    try:
+      return self._value(start)
+    except ARDException:
+      raise
+    except Exception as e:
+      raise DecodeError('cbor') from e
+
+  def _value(self, start):
+    buffer = self.buffer
+    major, info, argument, offset = read_header(buffer, start)
+    if major == 0:
+      return argument
+    elif major == 1:
+      return -1 - argument
+    elif (major == 2) and (argument is not None):
+      return buffer[offset:offset + argument]
+    elif (major == 3) and (argument is not None):
+      return str(buffer[offset:offset + argument], 'utf-8')
+    elif major == 4:
+      return LazyList(self, start)
+    elif major == 5:
+      return LazyMap(self, start)
+    elif major == 7:
+      if info == 20:
+        return False
+      elif info == 21:
+        return True
+      elif info == 22:
+        return None
+      elif info == 25:
+        return struct.unpack('>e', buffer[offset - 2:offset])[0]
+      elif info == 26:
+        return struct.unpack('>f', buffer[offset - 4:offset])[0]
+      elif info == 27:
+        return struct.unpack('>d', buffer[offset - 8:offset])[0]
+    # Tags and everything else
+    return self.decode(start)
+
+  def key(self, start, end):
+    initial = self.buffer[start]
+    major = initial >> 5
+    if (major < 2) or ((major == 3) and ((initial & 0x1f) != 31)):
+      return self.value(start)
+    # Decode as the key of a single-entry map (with a null value), so that it has the same form as
+    # in a fully decoded map
+    code = b'\xa1' + self.buffer[start:end] + b'\xf6'
+    for key in cbor.read(io.BytesIO(code)):
+      return key
+
+  def decode(self, start):
+    try:
+      self.stream.seek(start)
+      return self.decoder.decode()
+    except Exception as e:
+      raise DecodeError('cbor') from e
+
+
+class _ViewStream:
+  '''
+  A readable stream over a memoryview for cbor2, copying only what is read.
+  '''
+
+  __slots__ = ('view', 'position')
+
+  def __init__(self, view):
+    self.view = view
+    self.position = 0
+
+  def read(self, size=-1):
+    start = self.position
+    end = len(self.view) if size < 0 else min(start + size, len(self.view))
+    self.position = end
+    return self.view[start:end].tobytes()
+
+  def seek(self, offset, whence=io.SEEK_SET):
+    if whence == io.SEEK_CUR:
+      offset += self.position
+    elif whence == io.SEEK_END:
+      offset += len(self.view)
+    self.position = offset
+    return offset
+
+  def tell(self):
+    return self.position
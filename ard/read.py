@@ -1,10 +1,7 @@
 
-import ruamel.yaml, json, cbor2
 from .exceptions import *
-from .yaml import SafeConstructor as YAMLSafeConstructor
-from .json import Encoder as JSONEncoder
-from .cjson import convert_from as convert_from_cjson
-from .cbor import convert_frozendicts_to_maps
+from .codec import readers
+from . import stats as _stats
 
 __all__ = (
   'read',
@@ -12,7 +9,12 @@ __all__ = (
   'read_json',
   'read_cjson',
   'read_xml',
-  'read_cbor')
+  'read_cbor',
+  'read_all',
+  'read_all_yaml',
+  'read_all_json',
+  'read_all_cjson',
+  'read_all_cbor')
 
 
 def read(stream, format='yaml'):
@@ -30,33 +32,88 @@ def read(stream, format='yaml'):
     raise ARDException('unsupported format: ' + format)
 
 def read_yaml(stream):
-  try:
-    yaml=ruamel.yaml.YAML(typ='safe')
-    yaml.Constructor = YAMLSafeConstructor
-    return yaml.load(stream)
-  except Exception as e:
-    raise DecodeError('yaml') from e
+  return _read(stream, 'yaml')
 
 def read_json(stream):
-  try:
-    return json.load(stream)
-  except Exception as e:
-    raise DecodeError('json') from e
+  return _read(stream, 'json')
 
 def read_cjson(stream):
-  cjson = read_json(stream)
-  try:
-    return convert_from_cjson(cjson)
-  except Exception as e:
-    raise DecodeError('cjson') from e
+  return _read(stream, 'cjson')
 
 def read_xml(stream):
-  # TODO
-  raise NotImplementedError('xml')
+  return _read(stream, 'xml')
 
 def read_cbor(stream):
+  return _read(stream, 'cbor')
+
+def _read(stream, format):
+  reader = readers.acquire(format)
+  try:
+    stats = _stats.current
+    if stats is None:
+      value = reader.read(stream)
+    else:
+      with stats.timer('read.' + format):
+        value = reader.read(stream)
+  except Exception as e:
+    # The reader's state is unknown, so we will not return it to the pool
+    raise DecodeError(format) from e
+  readers.release(reader, format)
+  return value
+
+def read_all(stream, format='yaml'):
+  '''
+  Yields the values of a multi-value stream one at a time: a YAML multi-document stream,
+  JSON Lines, CJSON Lines, or a CBOR sequence.
+  '''
+  if (format == 'yaml') or (format == ''):
+    return read_all_yaml(stream)
+  elif format == 'json':
+    return read_all_json(stream)
+  elif format == 'cjson':
+    return read_all_cjson(stream)
+  elif format == 'cbor':
+    return read_all_cbor(stream)
+  else:
+    raise ARDException('unsupported format: ' + format)
+
+def read_all_yaml(stream):
+  return _read_all(stream, 'yaml')
+
+def read_all_json(stream):
+  return _read_all(stream, 'json')
+
+def read_all_cjson(stream):
+  return _read_all(stream, 'cjson')
+
+def read_all_cbor(stream):
+  return _read_all(stream, 'cbor')
+
+def _read_all(stream, format):
+  reader = readers.acquire(format)
   try:
-    decoder = cbor2.CBORDecoder(stream)
-    return convert_frozendicts_to_maps(decoder.decode())
+    values = reader.read_all(stream)
+    if _stats.current is None:
+      yield from values
+    else:
+      yield from _timed_values(values, 'read_all.' + format)
   except Exception as e:
-    raise DecodeError('cbor') from e
+    # The reader's state is unknown, so we will not return it to the pool
+    raise DecodeError(format) from e
+  # Note that if we are closed early the reader will not be returned to the pool either
+  readers.release(reader, format)
+
+def _timed_values(values, phase):
+  # Times the reading of each value, but not the processing of it by our caller
+  values = iter(values)
+  while True:
+    stats = _stats.current
+    if stats is None:
+      yield from values
+      return
+    with stats.timer(phase):
+      try:
+        value = next(values)
+      except StopIteration:
+        return
+    yield value
@@ -0,0 +1,141 @@
+
+import time, functools
+
+__all__ = (
+  'Stats',
+  'get_stats')
+
+# The enabled Stats, if any
+current = None
+
+# The enabled Stats, innermost last
+_stack = []
+
+# Functions that are called with True or False when instrumentation is switched on or off
+_switches = []
+
+
+class Stats:
+  '''
+  Per-phase timings and counters, collected while enabled. Can be used as a context manager.
+
+  Phases are named by operation and format, e.g. "read.cbor", "write.json", or "convert_from.cjson".
+  Note that the CJSON and CBOR readers convert while parsing, so their conversion time is part of the
+  read phase, while "convert" phases time the separate conversion passes (which also happen for keys).
+
+  The counters are of node visits in the conversion passes, Map lookups, and comparisons of complex
+  keys. If a callback is provided it is called with (phase, seconds) for every timing, e.g. in order
+  to export it to a metrics system.
+
+  Instrumentation is process-wide and adds no overhead while disabled. Stats can be nested, in which
+  case only the innermost collects, but must be disabled in the reverse order of enabling. Not
+  thread-safe: counts from concurrent threads may be lost.
+  '''
+  def __init__(self, callback=None):
+    self.callback = callback
+    self.reset()
+
+  def reset(self):
+    self.times = {}
+    self.calls = {}
+    self.nodes = 0
+    self.map_lookups = 0
+    self.key_comparisons = 0
+
+  def enable(self):
+    global current
+    if self in _stack:
+      raise ValueError('stats already enabled')
+    _stack.append(self)
+    current = self
+    if len(_stack) == 1:
+      _switch(True)
+
+  def disable(self):
+    global current
+    if current is not self:
+      raise ValueError('stats not enabled or not the innermost')
+    _stack.pop()
+    if _stack:
+      current = _stack[-1]
+    else:
+      current = None
+      _switch(False)
+
+  def add_time(self, phase, seconds):
+    self.times[phase] = self.times.get(phase, 0.0) + seconds
+    self.calls[phase] = self.calls.get(phase, 0) + 1
+    if self.callback is not None:
+      self.callback(phase, seconds)
+
+  def timer(self, phase):
+    '''
+    A context manager that times a phase.
+    '''
+    return _Timer(self, phase)
+
+  def as_dict(self):
+    return {
+      'times': dict(self.times),
+      'calls': dict(self.calls),
+      'nodes': self.nodes,
+      'map_lookups': self.map_lookups,
+      'key_comparisons': self.key_comparisons}
+
+  def __enter__(self):
+    self.enable()
+    return self
+
+  def __exit__(self, *args):
+    self.disable()
+
+
+def get_stats():
+  '''
+  The enabled Stats, or None if instrumentation is disabled.
+  '''
+  return current
+
+def timed(phase):
+  '''
+  A decorator that times calls of the function as a phase while instrumentation is enabled.
+  '''
+  def decorator(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      stats = current
+      if stats is None:
+        return function(*args, **kwargs)
+      start = time.perf_counter()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        stats.add_time(phase, time.perf_counter() - start)
+    return wrapper
+  return decorator
+
+def on_switch(function):
+  '''
+  Registers a function to be called with True or False when instrumentation is switched on or off.
+  '''
+  _switches.append(function)
+  return function
+
+def _switch(enabled):
+  for function in _switches:
+    function(enabled)
+
+
+class _Timer:
+  __slots__ = ('stats', 'phase', 'start')
+
+  def __init__(self, stats, phase):
+    self.stats = stats
+    self.phase = phase
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *args):
+    self.stats.add_time(self.phase, time.perf_counter() - self.start)
@@ -0,0 +1,98 @@
+
+import itertools
+from . import stats as _stats
+
+__all__ = (
+  'transform',
+  'items_of',
+  'pairs_of',
+  'build_list',
+  'build_tuple')
+
+
+def transform(value, expand, leaf_classes=frozenset()):
+  '''
+  Transforms a tree of values without recursion, so it can handle arbitrarily deep trees.
+
+  The expand function is called for every node and returns one of the following:
+  * None if the node is to be kept as is
+  * A tuple of (None, replacement) if the node is to be replaced
+  * A tuple of (children, build) if the node is a container to descend into, in which case
+    build(node, results, converted) will be called after all children have been transformed,
+    where results is a list of the transformed children and converted is True if any of them was
+    changed; build should return the node itself if it does not have to be changed
+
+  Changes are detected by identity, so that unchanged subtrees are returned as is.
+
+  As an optimization, expand will not be called for nodes of the types in leaf_classes (exact
+  classes, not subclasses), which are always kept as is.
+  '''
+  stats = _stats.current
+  if stats is not None:
+    # Visit every node, so that it can be counted
+    expand = _counted(expand, stats)
+    leaf_classes = frozenset()
+
+  expansion = expand(value)
+  if expansion is None:
+    return value
+  children, build = expansion
+  if children is None:
+    return build
+
+  # Frames are [node, children iterator, build, results, converted]
+  stack = [[value, iter(children), build, [], False]]
+  while True:
+    frame = stack[-1]
+    results = frame[3]
+    for child in frame[1]:
+      if child.__class__ in leaf_classes:
+        results.append(child)
+        continue
+      expansion = expand(child)
+      if expansion is None:
+        results.append(child)
+      else:
+        children, build = expansion
+        if children is None:
+          results.append(build)
+          frame[4] = True
+        else:
+          stack.append([child, iter(children), build, [], False])
+          break
+    else:
+      # All children have been transformed
+      stack.pop()
+      node, _, build, results, converted = frame
+      result = build(node, results, converted)
+      if not stack:
+        return result
+      frame = stack[-1]
+      frame[3].append(result)
+      if result is not node:
+        frame[4] = True
+
+def _counted(expand, stats):
+  def counted(value):
+    stats.nodes += 1
+    return expand(value)
+  return counted
+
+def items_of(mapping):
+  '''
+  The keys and values of a mapping as a flat iterable of children: key, value, key, value, ...
+  '''
+  return itertools.chain.from_iterable(mapping.items())
+
+def pairs_of(results):
+  '''
+  The reverse of items_of: (key, value) pairs from the flat list of transformed children.
+  '''
+  iterator = iter(results)
+  return zip(iterator, iterator)
+
+def build_list(value, results, converted):
+  return results if converted else value
+
+def build_tuple(value, results, converted):
+  return tuple(results) if converted else value
@@ -1,11 +1,17 @@
 
-import collections.abc
+import array, itertools, collections.abc
+from . import stats as _stats
 
 __all__ = (
   'UInteger',
   'Map')
 
 
+_MISSING = object()
+_SIMPLE_KEY_TYPES = frozenset((str, int, float, bool, bytes, type(None)))
+_JSON_KEY_TYPES = (str, int, float, bool, type(None))
+
+
 class UInteger(int):
   '''
   An int that will be marked as unsigned where necessary.
@@ -15,22 +21,51 @@ class UInteger(int):
 class Map(collections.abc.MutableMapping):
   '''
   A dict-like object that supports arbitrary, even unhashable keys.
-  The cost is worst-case performance: implemented as a list rather than a hashtable.
+  Hashable keys are kept in an internal dict and have the same performance characteristics.
+  Unhashable keys are kept in a separate table, indexed by a structural fingerprint of their
+  contents, and are compared one by one only when their fingerprints match.
   Iteration retains insertion order.
-  Not thread-safe.
+  Not thread-safe, except that frozen instances can be read concurrently.
 
   Note: Getting the hash of an instance will cause it to become immutable
-  because we cannot allow the hash to change from that point onward.
+  because we cannot allow the hash to change from that point onward. This also happens to Maps
+  used as (or within) keys of another Map.
+
+  Note: Unhashable keys that are not Maps (dicts and lists) cannot be made immutable. If such a key is
+  modified after it was added, reindex() must be called.
+
+  Note: Deleting a key from a Map that mixes hashable and unhashable keys takes time proportional to
+  its size.
   '''
 
+  __slots__ = ('_dict', '_complex', '_mutable', '_deep', '_hash', '_digest')
+
   def __init__(self, items=None, **kwargs):
-    self._items = []
+    self._dict = {}
+    # Our complex keys, or None if there are none
+    self._complex = None
     self._mutable = True
+    # True if frozen by ard.freeze(), which means that our values are deeply immutable, too
+    self._deep = False
     self._hash = None
+    self._digest = None
     self.update(items, **kwargs)
 
   def freeze(self):
     self._mutable = False
+    if self._complex is not None:
+      # So that reading will not modify us
+      self._complex.compact()
+
+  def reindex(self):
+    '''
+    Recalculates the fingerprints of unhashable keys.
+    Must be called if such keys were modified after being added.
+    '''
+    if self._complex is not None:
+      map_ = Map(self.items())
+      self._dict = map_._dict
+      self._complex = map_._complex
 
   def dict(self, strict=False, json=False):
     '''
@@ -38,22 +73,21 @@ class Map(collections.abc.MutableMapping):
     If cannot be converted (due to an incompatible key) will return self if strict is False,
     otherwise will raise a TypeError.
     '''
-    dict_ = {}
-    for key, value in self._items:
-      try:
-        if json and not isinstance(key, (str, int, float, bool, None)):
-          # JSON has strict requirements for key types beyond them being hashable
-          raise TypeError()
-        dict_[key] = value
-      except TypeError:
-        # Cannot be converted to a dict
-        if strict:
-          raise
-        else:
-          return self
-    return dict_
-
-  # JSON serializable
+    if self._complex is not None:
+      self._complex.compact()
+      unsupported = self._complex.keys()
+    elif json:
+      # JSON has strict requirements for key types beyond them being hashable
+      unsupported = [key for key in self._dict if not isinstance(key, _JSON_KEY_TYPES)]
+    else:
+      unsupported = ()
+    for key in unsupported:
+      # Cannot be converted to a dict
+      if strict:
+        raise TypeError('unsupported key: ' + repr(key))
+      else:
+        return self
+    return dict(self._dict)
 
   # Mimic the "dict" contract
   # See: https://docs.python.org/3/library/stdtypes.html#dict
@@ -68,36 +102,44 @@ class Map(collections.abc.MutableMapping):
     return _MapItems(self)
 
   def get(self, key, default=None):
-    for key_, value in self._items:
-      if key_ == key:
-        return value
-    return default
+    if (key.__class__ not in _SIMPLE_KEY_TYPES) and _is_complex(key):
+      return self._complex.get(key, default) if self._complex is not None else default
+    return self._dict.get(key, default)
 
-  def pop(self, key, **kwargs):
+  def pop(self, key, default=_MISSING):
     if not self._mutable:
       raise TypeError('this Map is immutable')
-    for index, (key_, value) in enumerate(self._items):
-      if key_ == key:
-        del self._items[index]
-        return value
     try:
-      return kwargs['default']
+      value = self[key]
     except KeyError:
-      raise KeyError(key)
+      if default is _MISSING:
+        raise
+      return default
+    del self[key]
+    return value
 
   def popitem(self):
     if not self._mutable:
       raise TypeError('this Map is immutable')
-    return self._items.pop()
+    complex_ = self._complex
+    if (complex_ is None) or ((complex_.order is not None) and (complex_.order[-1] == 0)):
+      item = self._dict.popitem()
+      if complex_ is not None:
+        complex_.order.pop()
+      return item
+    item = complex_.pop_last()
+    if not complex_.size():
+      self._complex = None
+    return item
 
   def setdefault(self, key, default=None):
     if not self._mutable:
       raise TypeError('this Map is immutable')
-    for key_, value in self._items:
-      if key_ == key:
-        return value
-    self._items.append((key, default))
-    return default
+    try:
+      return self[key]
+    except KeyError:
+      self[key] = default
+      return default
 
   def update(self, other=None, **kwargs):
     if not self._mutable:
@@ -114,66 +156,97 @@ class Map(collections.abc.MutableMapping):
 
     for key, value in kwargs.items():
       self.__setitem__(key, value)
-    
+
     return None
 
   def clear(self):
     if not self._mutable:
       raise TypeError('this Map is immutable')
-    self._items = []
+    self._dict = {}
+    self._complex = None
 
   def copy(self):
     copy = Map()
-    copy._items = list(self._items)
+    copy._dict = self._dict.copy()
+    if self._complex is not None:
+      copy._complex = self._complex.copy()
     return copy
 
   # See: https://docs.python.org/3/reference/datamodel.html
 
+  def __reduce__(self):
+    # Fingerprints of complex keys are hashes, which are not stable between processes,
+    # so we must not pickle our internal table
+    return self.__class__, (list(self.items()),), self._mutable
+
+  def __setstate__(self, mutable):
+    self._mutable = mutable
+
   def __hash__(self):
-    self.freeze()
     if self._hash is None:
-      self._hash = hash(tuple(self._items))
+      self.freeze()
+      self._hash = _fingerprint_map(self, True)
     return self._hash
 
   def __len__(self):
-    return len(self._items)
+    if self._complex is None:
+      return len(self._dict)
+    return len(self._dict) + self._complex.size()
 
   def __contains__(self, key):
-    for key_, _ in self._items:
-      if key_ == key:
-        return True
-    return False
+    if (key.__class__ not in _SIMPLE_KEY_TYPES) and _is_complex(key):
+      return (self._complex is not None) and (self._complex.find(key) >= 0)
+    return key in self._dict
 
   def __getitem__(self, key):
-    for key_, value in self._items:
-      if key_ == key:
-        return value
-    raise KeyError(key)
+    if (key.__class__ not in _SIMPLE_KEY_TYPES) and _is_complex(key):
+      value = self._complex.get(key, _MISSING) if self._complex is not None else _MISSING
+      if value is _MISSING:
+        raise KeyError(key)
+      return value
+    try:
+      return self._dict[key]
+    except KeyError:
+      raise KeyError(key) from None
 
   def __setitem__(self, key, value):
     if not self._mutable:
-      return NotImplemented
-    for index, item in enumerate(self._items):
-      if item[0] == key:
-        item[1] = value
-        return
-    self._items.append((key, value))
+      raise TypeError('this Map is immutable')
+    if (key.__class__ not in _SIMPLE_KEY_TYPES) and _is_complex(key):
+      if self._complex is None:
+        self._complex = _ComplexKeys()
+      self._complex.set(key, value)
+    else:
+      dict_ = self._dict
+      if (self._complex is not None) and (key not in dict_):
+        self._complex.add_hashable(len(dict_))
+      dict_[key] = value
 
   def __delitem__(self, key):
     if not self._mutable:
-      return NotImplemented
-    for index, (key_, _) in enumerate(self._items):
-      if key_ == key:
-        del self._items[index]
-        return
+      raise TypeError('this Map is immutable')
+    if (key.__class__ not in _SIMPLE_KEY_TYPES) and _is_complex(key):
+      if (self._complex is None) or not self._complex.discard(key):
+        raise KeyError(key)
+      if not self._complex.size():
+        self._complex = None
+    else:
+      dict_ = self._dict
+      if key not in dict_:
+        raise KeyError(key)
+      if self._complex is not None:
+        self._complex.remove_hashable(dict_, key)
+      del dict_[key]
 
   def __iter__(self):
-    for key, _ in self._items:
-      yield key
+    if self._complex is None:
+      return iter(self._dict)
+    return _merge(self._complex, self._dict, 'keys')
 
   def __reversed__(self):
-    for key, _ in reversed(self._items):
-      yield key
+    if self._complex is None:
+      return reversed(self._dict)
+    return _merge(self._complex, reversed(self._dict), 'keys', True)
 
   def __or__(self, other): # self | other
     copy = self.copy()
@@ -195,11 +268,22 @@ class Map(collections.abc.MutableMapping):
     '''
     Equality does not take insertion order into consideration.
     '''
+    if isinstance(other, Map):
+      if self._dict != other._dict:
+        return False
+      if (self._complex is None) or (other._complex is None):
+        return self._complex is other._complex
+      return self._complex == other._complex
     if not isinstance(other, collections.abc.Mapping):
       return False
-    if len(self._items) != len(other):
+    if len(self) != len(other):
       return False
-    for key, value in self._items:
+    if isinstance(other, dict):
+      if self._complex is None:
+        return self._dict == other
+      # The dict might have an equivalent hashable mapping as a key, so its keys must be kept like ours
+      return self == Map(other)
+    for key, value in self.items():
       try:
         if value != other[key]:
           return False
@@ -211,55 +295,428 @@ class Map(collections.abc.MutableMapping):
     return self.__repr__()
 
   def __repr__(self):
-    return '{' + ', '.join((repr(k) + ': ' + repr(v) for k, v in self._items)) + '}'
+    return '{' + ', '.join((repr(k) + ': ' + repr(v) for k, v in self.items())) + '}'
 
 collections.abc.MutableMapping.register(Map)
 
+def _deeply_frozen_map(dict_, complex_=None):
+  # A faster constructor for ard.freeze(), for internal structures that are already populated
+  map_ = Map.__new__(Map)
+  map_._dict = dict_
+  map_._complex = complex_
+  if complex_ is not None:
+    complex_.compact()
+  map_._mutable = False
+  map_._deep = True
+  map_._hash = None
+  map_._digest = None
+  return map_
+
+# Keys
+#
+# Hashable keys are used as is in Map._dict. Complex keys are kept in a _ComplexKeys table, which
+# stores them as they are, alongside an array of their structural fingerprints and an open-addressing
+# index into that array (much like that of a dict), so that only keys with the same fingerprint are
+# compared. There are no per-key objects other than the keys themselves, and small tables (up to
+# _LINEAR_SIZE keys) are not indexed at all. Mappings are always considered complex, even if hashable
+# (e.g. a frozen Map), because they must compare equal to an equivalent dict, and so are tuples that
+# contain them.
+#
+# The fingerprint of a stored key is computed once, when the key is added. Map keys (at any depth) are
+# frozen at that point, so they cannot change. Other unhashable keys (dicts and lists) cannot be frozen,
+# and modifying them after they were added requires a call to Map.reindex().
+
+_UNSIGNED = (1 << 64) - 1
+_PERTURB_SHIFT = 5
+_LINEAR_SIZE = 8
+_EMPTY = -1
+_DUMMY = -2
+
+class _ComplexKeys(list):
+  # Our keys and values alternate in the list itself, which saves the memory of separate lists
+  __slots__ = ('fingerprints', 'index', 'holes', 'order')
+
+  def __init__(self):
+    # Small tables are searched linearly (without fingerprints), and are indexed only when they grow
+    self.fingerprints = None
+    self.index = None
+    # Removed keys are replaced with _MISSING until we are compacted
+    self.holes = 0
+    # How our keys are interleaved with the hashable keys of the Map in insertion order (1 for ours),
+    # or None if all of the hashable keys come first
+    self.order = None
+
+  def size(self):
+    return len(self) // 2 - self.holes
+
+  def keys(self, reverse=False):
+    return itertools.islice(reversed(self), 1, None, 2) if reverse else itertools.islice(self, 0, None, 2)
+
+  def values(self, reverse=False):
+    return itertools.islice(reversed(self), 0, None, 2) if reverse else itertools.islice(self, 1, None, 2)
+
+  def items(self, reverse=False):
+    return zip(self.keys(reverse), self.values(reverse))
+
+  def find(self, key):
+    '''
+    Returns the position of the key, or -1 if it is missing.
+    '''
+    return self._probe(key)[1]
+
+  def get(self, key, default=None):
+    position = self._probe(key)[1]
+    return self[position * 2 + 1] if position >= 0 else default
+
+  def set(self, key, value):
+    # Also freezes the Maps in the key
+    fingerprint = _fingerprint(key, True)
+    slot, position = self._probe(key, fingerprint)
+    if position >= 0:
+      self[position * 2 + 1] = value
+      return
+    position = len(self) // 2
+    self.append(key)
+    self.append(value)
+    if self.order is not None:
+      self.order.append(1)
+    index = self.index
+    if index is not None:
+      self.fingerprints.append(fingerprint)
+      index[slot] = position
+      # Holes count, too, because their slots are still taken. Slots are small, so we can grow fast.
+      if position * 3 >= len(index) * 2 - 3:
+        self._rebuild(len(index) * 4)
+    elif position == _LINEAR_SIZE:
+      # Our keys are already frozen, so their fingerprints are cached or cheap
+      self.fingerprints = array.array('q', [_fingerprint(key_, True) for key_ in self.keys()])
+      self._rebuild(_LINEAR_SIZE * 4)
+
+  def discard(self, key):
+    '''
+    Removes the key, returning False if it is missing.
+    '''
+    slot, position = self._probe(key)
+    if position < 0:
+      return False
+    self._remove(slot, position)
+    return True
+
+  def pop_last(self):
+    self.compact()
+    key, value = self[-2], self[-1]
+    fingerprint = self.fingerprints[-1] if self.fingerprints is not None else None
+    self._remove(self._probe(key, fingerprint)[0], len(self) // 2 - 1)
+    return key, value
+
+  def compact(self):
+    if self.holes:
+      keys = self[0::2]
+      present = [key is not _MISSING for key in keys]
+      self.fingerprints = array.array('q', itertools.compress(self.fingerprints, present))
+      self[:] = itertools.chain.from_iterable(itertools.compress(zip(keys, self[1::2]), present))
+      self.holes = 0
+      self._rebuild(len(self.index))
+
+  def add_hashable(self, count):
+    # Called before a hashable key is added to the dict, which has count keys
+    if self.order is None:
+      self.compact()
+      self.order = bytearray(count)
+      self.order.extend(b'\x01' * (len(self) // 2))
+    self.order.append(0)
+
+  def remove_hashable(self, dict_, key):
+    # Called before the hashable key is removed from the dict
+    if self.order is not None:
+      for rank, key_ in enumerate(dict_):
+        if (key_ is key) or (key_ == key):
+          _remove_nth(self.order, 0, rank)
+          return
+
+  def get_fingerprints(self):
+    if self.fingerprints is not None:
+      return self.fingerprints
+    return [_fingerprint(key, True) for key in self.keys()]
+
+  def copy(self):
+    copy = _ComplexKeys()
+    copy.extend(self)
+    copy.fingerprints = self.fingerprints[:] if self.fingerprints is not None else None
+    copy.index = self.index[:] if self.index is not None else None
+    copy.holes = self.holes
+    copy.order = bytearray(self.order) if self.order is not None else None
+    return copy
+
+  def _remove(self, slot, position):
+    if (self.index is not None) and (self.order is None):
+      # Leave a hole, so that the positions of the other keys do not change
+      self[position * 2] = _MISSING
+      self[position * 2 + 1] = None
+      self.index[slot] = _DUMMY
+      self.holes += 1
+      # When more than half of our entries are holes
+      if self.holes * 4 > len(self):
+        self.compact()
+      return
+    del self[position * 2:position * 2 + 2]
+    if self.order is not None:
+      # Our position is our rank, because we have no holes when we have an order
+      _remove_nth(self.order, 1, position)
+    if self.index is not None:
+      del self.fingerprints[position]
+      self._rebuild(len(self.index))
+
+  def _probe(self, key, fingerprint=None):
+    # Returns the slot in the index and the position of the key, or the free slot for it and -1
+    if self.index is None:
+      for position, key_ in enumerate(self.keys()):
+        if (key_ is key) or _keys_equal(key_, key):
+          return -1, position
+      return -1, -1
+
+    if fingerprint is None:
+      fingerprint = _fingerprint(key)
+    index = self.index
+    mask = len(index) - 1
+    perturb = fingerprint & _UNSIGNED
+    slot = perturb & mask
+    while True:
+      position = index[slot]
+      if position == _EMPTY:
+        return slot, -1
+      if (position >= 0) and (self.fingerprints[position] == fingerprint):
+        key_ = self[position * 2]
+        if (key_ is key) or _keys_equal(key_, key):
+          return slot, position
+      perturb >>= _PERTURB_SHIFT
+      slot = (slot * 5 + perturb + 1) & mask
+
+  def _rebuild(self, size):
+    index = _new_index(size)
+    mask = size - 1
+    for position, fingerprint in enumerate(self.fingerprints):
+      perturb = fingerprint & _UNSIGNED
+      slot = perturb & mask
+      while index[slot] != _EMPTY:
+        perturb >>= _PERTURB_SHIFT
+        slot = (slot * 5 + perturb + 1) & mask
+      index[slot] = position if self[position * 2] is not _MISSING else _DUMMY
+    self.index = index
+
+  def __eq__(self, other):
+    if self.size() != other.size():
+      return False
+    self.compact()
+    other.compact()
+    if list.__eq__(self, other):
+      # Same insertion order, which is common
+      return True
+    fingerprints = self.fingerprints if self.fingerprints is not None else itertools.repeat(None)
+    for (key, value), fingerprint in zip(self.items(), fingerprints):
+      position = other._probe(key, fingerprint)[1]
+      if position < 0:
+        return False
+      value_ = other[position * 2 + 1]
+      if (value_ is not value) and (value_ != value):
+        return False
+    return True
+
+def _new_index(size):
+  # Positions are always smaller than the size (see _ComplexKeys.set)
+  typecode = 'b' if size <= 0x80 else 'h' if size <= 0x8000 else 'i' if size <= 0x80000000 else 'q'
+  return array.array(typecode, (_EMPTY,)) * size
+
+def _remove_nth(order, flag, n):
+  offset = -1
+  for _ in range(n + 1):
+    offset = order.index(flag, offset + 1)
+  del order[offset]
+
+def _keys_equal(key, other):
+  return key == other
+
+def _merge(complex_, hashable, part, reverse=False):
+  # Iterates a part ('keys', 'values' or 'items') of a Map in insertion order, given the hashable part
+  complex_.compact()
+  complex_part = getattr(complex_, part)(reverse)
+  order = complex_.order
+  if order is None:
+    return itertools.chain(complex_part, hashable) if reverse else itertools.chain(hashable, complex_part)
+  return _interleave(reversed(order) if reverse else order, iter(hashable), complex_part)
+
+def _interleave(order, hashable, complex_items):
+  for flag in order:
+    yield next(complex_items) if flag else next(hashable)
+
+def _fingerprint(value, freeze=False):
+  '''
+  A hash computed from the structure of the value, which is consistent with equality: mappings
+  (including Maps) are compared regardless of insertion order and lists are compared item by item.
+  If freeze is True then all Maps encountered will be frozen and will cache their fingerprints.
+  '''
+  class_ = value.__class__
+  if class_ in _SIMPLE_KEY_TYPES:
+    return hash(value)
+  elif class_ is dict:
+    return _fingerprint_items(value.items(), freeze)
+  elif class_ is list:
+    return _fingerprint_sequence(value, freeze)
+  elif isinstance(value, Map):
+    if freeze or (value._hash is not None):
+      return value.__hash__()
+    return _fingerprint_map(value, False)
+  elif isinstance(value, collections.abc.Mapping):
+    return _fingerprint_items(value.items(), freeze)
+  elif isinstance(value, (list, tuple)):
+    if isinstance(value, tuple) and not _is_complex(value):
+      # Must be consistent with the hash of the tuple, because it is kept as a hashable key
+      return hash(value)
+    return _fingerprint_sequence(value, freeze)
+  try:
+    return hash(value)
+  except TypeError:
+    # Unknown unhashable type: always in the same bucket
+    return 0
+
+def _is_complex(value):
+  '''
+  True if the value is or contains (in tuples) a mapping or an unhashable value. Such tuples are
+  complex keys and are fingerprinted by their structure even if they are hashable (e.g. with a frozen
+  Map in them), so that they are consistent with equal tuples that are not hashable (e.g. with a dict).
+  '''
+  class_ = value.__class__
+  if class_ in _SIMPLE_KEY_TYPES:
+    return False
+  elif isinstance(value, tuple):
+    for item in value:
+      if _is_complex(item):
+        return True
+    return False
+  elif (class_ is dict) or (class_ is list) or isinstance(value, collections.abc.Mapping):
+    return True
+  try:
+    hash(value)
+    return False
+  except TypeError:
+    return True
+
+def _fingerprint_items(items, freeze):
+  return hash(frozenset([(
+    hash(key) if key.__class__ in _SIMPLE_KEY_TYPES else _fingerprint(key, freeze),
+    hash(value) if value.__class__ in _SIMPLE_KEY_TYPES else _fingerprint(value, freeze))
+    for key, value in items]))
+
+def _fingerprint_sequence(sequence, freeze):
+  return hash(tuple([hash(value) if value.__class__ in _SIMPLE_KEY_TYPES else _fingerprint(value, freeze) for value in sequence]))
+
+def _fingerprint_map(map_, freeze):
+  # Hashable keys are fingerprinted by their hashes, and we already have the fingerprints of our
+  # complex keys
+  pairs = [(
+    hash(key),
+    hash(value) if value.__class__ in _SIMPLE_KEY_TYPES else _fingerprint(value, freeze))
+    for key, value in map_._dict.items()]
+  if map_._complex is not None:
+    map_._complex.compact()
+    pairs.extend((
+      fingerprint,
+      hash(value) if value.__class__ in _SIMPLE_KEY_TYPES else _fingerprint(value, freeze))
+      for fingerprint, value in zip(map_._complex.get_fingerprints(), map_._complex.values()))
+  return hash(frozenset(pairs))
+
 # Views
 # See: https://docs.python.org/3/library/stdtypes.html#dict-views
 
 class _MapKeys(collections.abc.KeysView):
+  __slots__ = ()
+
   def __contains__(self, key):
-    for key_, _ in self._mapping._items:
-      if key_ == key:
-        return True
-    return False
+    return key in self._mapping
 
   def __iter__(self):
-    for key, _ in self._mapping._items:
-      yield key
+    return iter(self._mapping)
 
   def __reversed__(self):
-    for key, _ in reversed(self._mapping._items):
-      yield key
+    return reversed(self._mapping)
 
 collections.abc.KeysView.register(_MapKeys)
 
 class _MapValues(collections.abc.ValuesView):
+  __slots__ = ()
+
   def __contains__(self, value):
-    for _, value_ in self._mapping._items:
+    for value_ in self:
       if value_ == value:
         return True
     return False
 
   def __iter__(self):
-    for _, value in self._mapping._items:
-      yield value
+    map_ = self._mapping
+    if map_._complex is None:
+      return iter(map_._dict.values())
+    return _merge(map_._complex, map_._dict.values(), 'values')
 
   def __reversed__(self):
-    for _, value in reversed(self._mapping._items):
-      yield value
+    map_ = self._mapping
+    if map_._complex is None:
+      return reversed(map_._dict.values())
+    return _merge(map_._complex, reversed(map_._dict.values()), 'values', True)
 
 collections.abc.ValuesView.register(_MapValues)
 
 class _MapItems(collections.abc.ItemsView):
+  __slots__ = ()
+
   def __contains__(self, item):
-    return item in self._mapping._items
+    key, value = item
+    try:
+      value_ = self._mapping[key]
+    except KeyError:
+      return False
+    return value_ is value or value_ == value
 
   def __iter__(self):
-    yield from self._mapping._items
+    map_ = self._mapping
+    if map_._complex is None:
+      return iter(map_._dict.items())
+    return _merge(map_._complex, map_._dict.items(), 'items')
 
   def __reversed__(self):
-    yield from reversed(self._mapping._items)
+    map_ = self._mapping
+    if map_._complex is None:
+      return reversed(map_._dict.items())
+    return _merge(map_._complex, reversed(map_._dict.items()), 'items', True)
 
 collections.abc.ItemsView.register(_MapItems)
+
+# Instrumentation
+#
+# While enabled, the counting versions of these functions are swapped in, so that there is no overhead
+# otherwise.
+
+_UNCOUNTED = {
+  (Map, '__getitem__'): Map.__getitem__,
+  (Map, '__contains__'): Map.__contains__,
+  (Map, 'get'): Map.get}
+
+_uncounted_keys_equal = _keys_equal
+
+def _counted_lookup(method):
+  def counted(self, *args):
+    _stats.current.map_lookups += 1
+    return method(self, *args)
+  return counted
+
+def _counted_comparison(function):
+  def counted(key, other):
+    _stats.current.key_comparisons += 1
+    return function(key, other)
+  return counted
+
+@_stats.on_switch
+def _instrument(enabled):
+  global _keys_equal
+  for (class_, name), method in _UNCOUNTED.items():
+    setattr(class_, name, _counted_lookup(method) if enabled else method)
+  _keys_equal = _counted_comparison(_uncounted_keys_equal) if enabled else _uncounted_keys_equal
@@ -1,11 +1,7 @@
 
-import ruamel.yaml, json, cbor2
 from .exceptions import *
-from .types import *
-from .yaml import represent_uinteger, represent_map
-from .json import Encoder as JSONEncoder
-from .cjson import convert_to as convert_to_cjson
-from .cbor import encoder_default as cbor_encoder_default
+from .codec import writers
+from . import stats as _stats
 
 __all__ = (
   'write',
@@ -13,10 +9,18 @@ __all__ = (
   'write_json',
   'write_cjson',
   'write_xml',
-  'write_cbor')
+  'write_cbor',
+  'write_all',
+  'write_all_yaml',
+  'write_all_json',
+  'write_all_cjson',
+  'write_all_cbor')
 
 
-def write(value, writer, format='yaml', indent='', strict=False):
+def write(value, writer, format='yaml', indent='', strict=False, canonical=False):
+  '''
+  If canonical is True then CBOR is deterministically encoded (see write_cbor()).
+  '''
   if (format == 'yaml') or (format == ''):
     write_yaml(value, writer, indent, strict)
   elif format == 'json':
@@ -26,44 +30,86 @@ def write(value, writer, format='yaml', indent='', strict=False):
   elif format == 'xml':
     write_xml(value, writer, indent)
   elif format == 'cbor':
-    write_cbor(value, writer)
+    write_cbor(value, writer, canonical)
   else:
     raise ARDException('unsupported format: ' + format)
 
 def write_yaml(value, writer, indent='', strict=False):
-  try:
-    yaml=ruamel.yaml.YAML(typ='safe')
-    yaml.indent = len(indent)
-    yaml.default_flow_style = False
-    yaml.representer.add_representer(UInteger, represent_uinteger)
-    yaml.representer.add_representer(Map, represent_map)
-    yaml.dump(value, writer)
-  except Exception as e:
-    raise EncodeError('yaml') from e
+  _write(value, writer, 'yaml', indent, strict)
 
 def write_json(value, writer, indent=''):
-  try:
-    if indent == '':
-      indent = None
-    json.dump(value, writer, ensure_ascii=False, indent=indent, cls=JSONEncoder)
-    writer.write('\n')
-  except Exception as e:
-    raise EncodeError('json') from e
+  _write(value, writer, 'json', indent)
 
 def write_cjson(value, writer, indent=''):
+  _write(value, writer, 'cjson', indent)
+
+def write_xml(value, writer, indent=''):
+  _write(value, writer, 'xml', indent)
+
+def write_cbor(value, writer, canonical=False):
+  '''
+  If canonical is True the encoding is deterministic as per RFC 8949 section 4.2.1, so that equal
+  values (see digest()) are always encoded to the same bytes: map entries are sorted by their encoded
+  keys and numbers use their shortest forms. This makes encoding several times slower.
+  '''
+  if canonical:
+    _write(value, writer, 'cbor', '', False, True)
+  else:
+    _write(value, writer, 'cbor')
+
+def _write(value, writer, format, *args):
+  writer_ = writers.acquire(format, *args)
   try:
-    value = convert_to_cjson(value)
+    stats = _stats.current
+    if stats is None:
+      writer_.write(value, writer)
+    else:
+      with stats.timer('write.' + format):
+        writer_.write(value, writer)
   except Exception as e:
-    raise EncodeError('cjson') from e
-  write_json(value, writer, indent)
+    # The writer's state is unknown, so we will not return it to the pool
+    raise EncodeError(format) from e
+  writers.release(writer_, format, *args)
 
-def write_xml(value, writer, indent=''):
-  # TODO
-  raise NotImplementedError('xml')
+def write_all(values, writer, format='yaml', indent='', strict=False):
+  '''
+  Writes an iterable of values as a multi-value stream: a YAML multi-document stream,
+  JSON Lines, CJSON Lines, or a CBOR sequence.
+  '''
+  if (format == 'yaml') or (format == ''):
+    write_all_yaml(values, writer, indent, strict)
+  elif format == 'json':
+    write_all_json(values, writer)
+  elif format == 'cjson':
+    write_all_cjson(values, writer)
+  elif format == 'cbor':
+    write_all_cbor(values, writer)
+  else:
+    raise ARDException('unsupported format: ' + format)
+
+def write_all_yaml(values, writer, indent='', strict=False):
+  _write_all(values, writer, 'yaml', indent, strict)
+
+def write_all_json(values, writer):
+  _write_all(values, writer, 'json')
+
+def write_all_cjson(values, writer):
+  _write_all(values, writer, 'cjson')
+
+def write_all_cbor(values, writer):
+  _write_all(values, writer, 'cbor')
 
-def write_cbor(value, writer):
+def _write_all(values, writer, format, *args):
+  writer_ = writers.acquire(format, *args)
   try:
-    encoder = cbor2.CBOREncoder(writer, default=cbor_encoder_default)
-    encoder.encode(value)
+    stats = _stats.current
+    if stats is None:
+      writer_.write_all(values, writer)
+    else:
+      # Note that this includes the time it takes to produce the values
+      with stats.timer('write_all.' + format):
+        writer_.write_all(values, writer)
   except Exception as e:
-    raise EncodeError('cbor') from e
+    # The writer's state is unknown, so we will not return it to the pool
+    raise EncodeError(format) from e
+  writers.release(writer_, format, *args)
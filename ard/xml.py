@@ -0,0 +1,232 @@
+
+import collections.abc, binascii, re, xml.etree.ElementTree
+from .types import *
+from .buffer import BYTES_CLASSES, BASE64_CHUNK_SIZE, MAX_CHUNKS, DEFAULT_SIZE, ChunkEncoder, byte_view, base64_chunks
+from .cjson import _encode_float
+from . import lazy
+
+__all__ = (
+  'Reader',
+  'Writer',
+  'read',
+  'write')
+
+# Characters that XML 1.0 cannot represent, even as character references
+_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+_ESCAPE = re.compile('[&<>\r]')
+_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '\r': '&#13;'}
+
+
+class Reader:
+  '''
+  A reusable XML reader.
+  '''
+  def read(self, stream):
+    return read(stream)
+
+
+class Writer:
+  '''
+  A reusable XML writer.
+  '''
+  def __init__(self, indent=''):
+    self.indent = indent
+
+  def write(self, value, writer):
+    write(value, writer, self.indent)
+    writer.write('\n')
+
+
+def read(stream):
+  '''
+  Reads XML incrementally, converting elements as soon as they end without building a DOM, so that
+  memory use is bounded by the size of the result.
+
+  The schema is that of write().
+  '''
+  builder = _Builder()
+  parser = xml.etree.ElementTree.XMLParser(target=builder)
+  while True:
+    chunk = stream.read(DEFAULT_SIZE)
+    if not chunk:
+      break
+    parser.feed(chunk)
+  root = parser.close()
+  if len(root) != 1:
+    raise ValueError('XML must have exactly one root element')
+  tag, value = root[0]
+  if tag in _WRAPPERS:
+    raise ValueError('unexpected element: ' + tag)
+  return value
+
+def write(value, writer, indent=''):
+  '''
+  Writes the value as XML in a single pass, without building a DOM.
+
+  Values are elements named by type: string, integer, uinteger, float, bool, null, bytes (as
+  base64), list (with the items as its children), and map (with entry children, each with a key and
+  a value child, which in turn contain a single value). Maps with complex keys, UIntegers, and bytes
+  are thus preserved.
+  '''
+  encoder = _Encoder(writer, indent)
+  encoder.chunks.append('<?xml version="1.0"?>\n')
+  encoder.encode(value, '\n' if indent else '')
+  encoder.flush()
+
+_WRAPPERS = frozenset(('entry', 'key', 'value'))
+_SCALARS = {'string': str, 'integer': int, 'uinteger': UInteger, 'float': float}
+
+def _build(tag, text, children):
+  if tag == 'string':
+    return text
+  elif tag == 'integer':
+    return int(text)
+  elif tag == 'uinteger':
+    return UInteger(text)
+  elif tag == 'float':
+    return float(text)
+  elif tag == 'bool':
+    text = text.strip()
+    if text == 'true':
+      return True
+    elif text == 'false':
+      return False
+    raise ValueError('invalid bool: ' + text)
+  elif tag == 'null':
+    return None
+  elif tag == 'bytes':
+    return binascii.a2b_base64(text)
+  elif tag == 'list':
+    list_ = []
+    for tag_, value in children:
+      if tag_ in _WRAPPERS:
+        raise ValueError('unexpected element in list: ' + tag_)
+      list_.append(value)
+    return list_
+  elif tag == 'map':
+    map_ = Map()
+    for tag_, entry in children:
+      if tag_ != 'entry':
+        raise ValueError('unexpected element in map: ' + tag_)
+      key, value = entry
+      map_[key] = value
+    return map_.dict()
+  elif tag == 'entry':
+    entry = dict(children)
+    if (len(children) != 2) or ('key' not in entry) or ('value' not in entry):
+      raise ValueError('entry must have a key and a value')
+    return entry['key'], entry['value']
+  elif (tag == 'key') or (tag == 'value'):
+    if (len(children) != 1) or (children[0][0] in _WRAPPERS):
+      raise ValueError(tag + ' must have exactly one value')
+    return children[0][1]
+  raise ValueError('unsupported element: ' + tag)
+
+class _Builder:
+  '''
+  An XMLParser target that converts elements to values when they end.
+  '''
+
+  __slots__ = ('frames', 'text')
+
+  def __init__(self):
+    # Frames are lists of (tag, value) tuples for the children of the open elements
+    self.frames = [[]]
+    self.text = []
+
+  def start(self, tag, attributes):
+    self.frames.append([])
+    self.text = []
+
+  def data(self, data):
+    self.text.append(data)
+
+  def end(self, tag):
+    children = self.frames.pop()
+    text = ''.join(self.text)
+    self.text = []
+    scalar = _SCALARS.get(tag)
+    if scalar is not None:
+      value = scalar(text)
+    else:
+      value = _build(tag, text, children)
+    self.frames[-1].append((tag, value))
+
+  def close(self):
+    return self.frames[0]
+
+def _escape(text):
+  if _INVALID.search(text) is not None:
+    raise ValueError('string cannot be represented in XML: ' + repr(text))
+  return _ESCAPE.sub(lambda match: _ESCAPES[match.group()], text)
+
+
+class _Encoder(ChunkEncoder):
+  '''
+  Writes XML elements to a buffer, which is flushed to the writer when it gets big enough.
+  '''
+
+  __slots__ = ()
+
+  def encode(self, value, newline):
+    chunks = self.chunks
+    if len(chunks) > MAX_CHUNKS:
+      self.flush()
+
+    if isinstance(value, str):
+      chunks.append('<string>' + _escape(value) + '</string>')
+
+    elif value is None:
+      chunks.append('<null/>')
+
+    elif value is True:
+      chunks.append('<bool>true</bool>')
+
+    elif value is False:
+      chunks.append('<bool>false</bool>')
+
+    elif isinstance(value, UInteger): # must be before checking for 'int'
+      chunks.append('<uinteger>' + str(int(value)) + '</uinteger>')
+
+    elif isinstance(value, int):
+      chunks.append('<integer>' + str(int(value)) + '</integer>')
+
+    elif isinstance(value, float):
+      chunks.append('<float>' + _encode_float(value) + '</float>')
+
+    elif isinstance(value, BYTES_CLASSES):
+      view = byte_view(value)
+      large = len(view) > BASE64_CHUNK_SIZE
+      chunks.append('<bytes>')
+      for chunk in base64_chunks(view):
+        chunks.append(chunk)
+        if large:
+          # Written as it is encoded rather than collected whole
+          self.flush()
+      chunks.append('</bytes>')
+
+    elif isinstance(value, (lazy.LazyMap, lazy.LazyList)):
+      self.encode(value.materialize(), newline)
+
+    elif isinstance(value, collections.abc.Mapping):
+      inner_newline = newline + self.indent
+      entry_newline = inner_newline + self.indent
+      chunks.append('<map>')
+      for key, value_ in value.items():
+        chunks.append(inner_newline + '<entry>' + entry_newline + '<key>')
+        self.encode(key, entry_newline)
+        chunks.append('</key>' + entry_newline + '<value>')
+        self.encode(value_, entry_newline)
+        chunks.append('</value>' + inner_newline + '</entry>')
+      chunks.append(newline + '</map>' if value else '</map>')
+
+    elif isinstance(value, (list, tuple)):
+      inner_newline = newline + self.indent
+      chunks.append('<list>')
+      for item in value:
+        chunks.append(inner_newline)
+        self.encode(item, inner_newline)
+      chunks.append(newline + '</list>' if value else '</list>')
+
+    else:
+      raise TypeError('cannot serialize type ' + type(value).__name__)
@@ -1,10 +1,71 @@
 
 import ruamel.yaml
 from .types import *
+from .buffer import *
+from .buffer import byte_view
+from . import lazy
 
 __all__ = (
+  'Reader',
+  'Writer',
   'SafeConstructor',
-  'represent_uinteger')
+  'SafeRepresenter',
+  'represent_uinteger',
+  'represent_buffer',
+  'represent_lazy')
+
+
+class Reader:
+  '''
+  A reusable YAML reader.
+  '''
+  def __init__(self):
+    self.yaml = ruamel.yaml.YAML(typ='safe')
+    self.yaml.Constructor = SafeConstructor
+
+  def read(self, stream):
+    return self.yaml.load(stream)
+
+  def read_all(self, stream):
+    '''
+    Yields the documents of a multi-document stream one at a time.
+    '''
+    yield from self.yaml.load_all(stream)
+
+
+class Writer:
+  '''
+  A reusable YAML writer.
+  '''
+  def __init__(self, indent='', strict=False):
+    self.yaml = ruamel.yaml.YAML(typ='safe')
+    self.yaml.Representer = SafeRepresenter
+    self.yaml.indent = len(indent)
+    self.yaml.default_flow_style = False
+    self.yaml.representer.add_representer(UInteger, represent_uinteger)
+    self.yaml.representer.add_representer(Map, represent_map)
+    self.yaml.representer.add_representer(bytearray, represent_buffer)
+    self.yaml.representer.add_representer(memoryview, represent_buffer)
+    self.yaml.representer.add_representer(lazy.LazyMap, represent_lazy)
+    self.yaml.representer.add_representer(lazy.LazyList, represent_lazy)
+
+  def write(self, value, writer):
+    self.yaml.dump(value, writer)
+
+  def write_all(self, values, writer):
+    '''
+    Writes the values as a multi-document stream, batching the writes.
+    '''
+    buffer = Buffer(writer)
+
+    def documents():
+      for value in values:
+        yield value
+        # The previous document has been fully written by now
+        buffer.drain()
+
+    self.yaml.dump_all(documents(), buffer.stream)
+    buffer.drain(True)
 
 
 class SafeConstructor(ruamel.yaml.constructor.SafeConstructor):
@@ -34,8 +95,30 @@ class RoundTripConstructor(ruamel.yaml.constructor.RoundTripConstructor):
     self.yaml_base_dict_type = Map
 
 
+class SafeRepresenter(ruamel.yaml.representer.SafeRepresenter):
+  '''
+  A SafeRepresenter that treats bytearrays and memoryviews as scalars, like bytes, so that they are
+  never represented as aliases.
+  '''
+  def ignore_aliases(self, data):
+    return isinstance(data, (bytearray, memoryview)) or super().ignore_aliases(data)
+
+
 def represent_uinteger(representer, data):
   return representer.represent_int(data)
 
 def represent_map(representer, data):
   return representer.represent_dict(data)
+
+def represent_buffer(representer, data):
+  '''
+  Represents bytearrays and memoryviews as !!binary, like bytes. The emitter needs the whole scalar,
+  so the base64 is built whole, but the data itself is not copied.
+  '''
+  return representer.represent_binary(byte_view(data))
+
+def represent_lazy(representer, data):
+  '''
+  Represents lazy proxies (see ard.lazy) by fully decoding them.
+  '''
+  return representer.represent_data(data.materialize())
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+
+import argparse, os, timeit, tracemalloc, json, io, binascii, asyncio, copy, cbor2, ard
+
+
+benchmarks = {}
+
+def benchmark(name):
+  '''
+  Registers a benchmark function under a name.
+  '''
+  def decorator(function):
+    benchmarks[name] = function
+    return function
+  return decorator
+
+def measure(statement, number):
+  '''
+  Returns the best time per call, in microseconds.
+  '''
+  return min(timeit.repeat(statement, number=number, repeat=3)) / number * 1000000
+
+def measure_memory(function, number):
+  '''
+  Returns the memory retained per call, in bytes.
+  '''
+  tracemalloc.start()
+  try:
+    retained = [function() for _ in range(number)]
+    size, _ = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  del retained
+  return size / number
+
+def measure_peak_memory(function):
+  '''
+  Returns the peak memory allocated during a call, in bytes.
+  '''
+  tracemalloc.start()
+  try:
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return peak
+
+results = []
+saved = {}
+
+def report(group, case, size, time, baseline=None, unit='µs', versus='dict'):
+  '''
+  Prints a result and records it, relative to the baseline (named by versus) if provided. If a
+  saved baseline run has the same result, the change is printed, too.
+  '''
+  line = '{:<12} {:<28} {:>8} {:>14.2f} {}'.format(group, case, size, time, unit)
+  if baseline is not None:
+    line += ' {:>8.1f}x {}'.format(time / baseline, versus)
+  saved_time = saved.get((group, case, str(size)))
+  if saved_time:
+    line += ' {:>+8.1f}% vs saved'.format((time / saved_time - 1) * 100)
+  print(line)
+  results.append({'group': group, 'case': case, 'size': str(size), 'time': time, 'unit': unit})
+
+def load_results(path):
+  with open(path) as f:
+    return {(result['group'], result['case'], result['size']): result['time'] for result in json.load(f)}
+
+def save_results(path):
+  with open(path, 'w') as f:
+    json.dump(results, f, indent=2)
+    f.write('\n')
+
+
+# Documents
+
+class NullWriter:
+  def write(self, data):
+    return len(data)
+
+class AsyncNullWriter:
+  def write(self, data):
+    pass
+
+  async def drain(self):
+    pass
+
+def records_document(size):
+  return [{
+    'id': i,
+    'name': 'record {}'.format(i),
+    'score': i / 3,
+    'tags': ['a', 'b', 'c'],
+    'counts': {'x': i, 'y': ard.UInteger(i)},
+    'blob': b'\x00' * 16,
+  } for i in range(size)]
+
+def plain_document(size):
+  # Nothing that needs CJSON encoding
+  return [{
+    'name': 'record {}'.format(i),
+    'score': i / 3,
+    'tags': ['a', 'b', 'c'],
+    'position': {'x': i / 7, 'y': None, 'visible': True},
+  } for i in range(size)]
+
+def deep_document(depth):
+  value = 'leaf'
+  for i in range(depth):
+    value = {'depth': i, 'child': [value]}
+  return value
+
+def wide_document(width):
+  return {'key{}'.format(i): [i, 'value', 1.5] for i in range(width)}
+
+
+# Corpus
+
+SHAPES = ('flat', 'deep', 'wide', 'complex-keys', 'bytes', 'integers')
+FORMATS = ('yaml', 'json', 'cjson', 'xml', 'cbor')
+
+def corpus(shape, size):
+  '''
+  Generates a synthetic document of a shape, growing linearly with size.
+  '''
+  if shape == 'flat':
+    return records_document(size)
+  elif shape == 'deep':
+    # Deeper nesting would exceed the recursion limit of some formats
+    return [deep_document(50) for _ in range(max(1, size // 50))]
+  elif shape == 'wide':
+    return wide_document(size)
+  elif shape == 'complex-keys':
+    return ard.Map(({'id': i, 'tags': ['a', 'b']}, 'value {}'.format(i)) for i in range(size))
+  elif shape == 'bytes':
+    return [bytes(range(256)) * 4 for _ in range(size)]
+  elif shape == 'integers':
+    return [[i * 7919, -i, ard.UInteger(i), 2**70 + i] for i in range(size)]
+  raise ValueError('unsupported shape: ' + shape)
+
+@benchmark('formats')
+def formats_benchmark():
+  for format in FORMATS:
+    binary = format == 'cbor'
+    new_stream = io.BytesIO if binary else io.StringIO
+    # YAML is much slower than the others
+    sizes = (10, 100) if format == 'yaml' else (10, 100, 1000)
+    for shape in SHAPES:
+      for size in sizes:
+        value = corpus(shape, size)
+        try:
+          code = ard.encode_cbor_bytes(value) if binary else ard.encode(value, format)
+        except ard.EncodeError:
+          # e.g. JSON does not support bytes
+          continue
+        number = max(1, 1000 // size)
+        group = 'format-' + format
+        decode = ard.decode_cbor_bytes if binary else (lambda code: ard.decode(code, format))
+        encode = ard.encode_cbor_bytes if binary else (lambda value: ard.encode(value, format))
+        report(group, 'encode ({})'.format(shape), size, measure(lambda: encode(value), number))
+        report(group, 'decode ({})'.format(shape), size, measure(lambda: decode(code), number))
+        report(group, 'read ({})'.format(shape), size, measure(lambda: ard.read(new_stream(code), format), number))
+        report(group, 'write ({})'.format(shape), size, measure(lambda: ard.write(value, NullWriter(), format), number))
+
+
+# Map
+
+SIZES = (10, 100, 1000, 10000)
+
+@benchmark('map')
+def map_benchmark():
+  for size in SIZES:
+    keys = ['key{}'.format(i) for i in range(size)]
+    items = [(key, i) for i, key in enumerate(keys)]
+    number = max(1, 100000 // size)
+
+    dict_build = measure(lambda: dict(items), number)
+    report('map', 'build (string keys)', size, measure(lambda: ard.Map(items), number), dict_build)
+
+    # A single complex key is what usually causes a Map to be used instead of a dict
+    complex_items = items + [({'complex': 'key'}, size)]
+    report('map', 'build (+1 complex key)', size, measure(lambda: ard.Map(complex_items), number), dict_build)
+
+    dict_ = dict(items)
+    map_ = ard.Map(complex_items)
+    dict_lookup = measure(lambda: [dict_[key] for key in keys], number)
+    report('map', 'lookup all (string keys)', size, measure(lambda: [map_[key] for key in keys], number), dict_lookup)
+    report('map', 'lookup one (complex key)', size, measure(lambda: map_[{'complex': 'key'}], number))
+
+    # All keys complex, as in YAML documents keyed by structures
+    complex_keys = [{'id': i, 'tags': ['a', 'b']} for i in range(size)]
+    complex_items = [(key, i) for i, key in enumerate(complex_keys)]
+    map_ = ard.Map(complex_items)
+    report('map', 'build (complex keys)', size, measure(lambda: ard.Map(complex_items), number), dict_build)
+    report('map', 'lookup all (complex keys)', size, measure(lambda: [map_[key] for key in complex_keys], number), dict_lookup)
+
+    for kind, items_ in (('string keys', items), ('complex keys', complex_items)):
+      keys_ = [key for key, _ in items_]
+
+      def set_all(map_):
+        for key, value in items_:
+          map_[key] = value
+        return map_
+
+      def delete_all(map_):
+        for key in keys_:
+          del map_[key]
+
+      map_ = ard.Map(items_)
+      other = ard.Map(items_)
+      report('map', 'set all ({})'.format(kind), size, measure(lambda: set_all(ard.Map()), number), measure(lambda: set_all({}), number) if kind == 'string keys' else None)
+      report('map', 'delete all ({})'.format(kind), size, measure(lambda: delete_all(ard.Map(items_)), number))
+      report('map', 'contains all ({})'.format(kind), size, measure(lambda: [key in map_ for key in keys_], number))
+      report('map', 'iterate items ({})'.format(kind), size, measure(lambda: list(map_.items()), number))
+      report('map', 'copy ({})'.format(kind), size, measure(lambda: map_.copy(), number))
+      report('map', 'equals ({})'.format(kind), size, measure(lambda: map_ == other, number))
+      if kind == 'string keys':
+        report('map', 'equals dict ({})'.format(kind), size, measure(lambda: map_ == dict_, number))
+      report('map', 'digest ({})'.format(kind), size, measure(lambda: ard.digest(map_), number))
+
+@benchmark('map-memory')
+def map_memory_benchmark():
+  for size in (0, 1, 4, 16, 256, 4096):
+    items = [('key{}'.format(i), i) for i in range(size)]
+    number = max(10, 10000 // (size or 1))
+
+    dict_memory = measure_memory(lambda: dict(items), number)
+    report('map-memory', 'dict', size, dict_memory, unit='B')
+    report('map-memory', 'Map (string keys)', size, measure_memory(lambda: ard.Map(items), number), dict_memory, unit='B')
+
+    # Maps used to be lists of pairs, which is what Maps with complex keys should be compared with
+    complex_items = [({'id': i}, i) for i in range(size)]
+    pairs_memory = measure_memory(lambda: [(key, value) for key, value in complex_items], number)
+    report('map-memory', 'pairs (complex keys)', size, pairs_memory, dict_memory, unit='B')
+    report('map-memory', 'Map (complex keys)', size, measure_memory(lambda: ard.Map(complex_items), number), pairs_memory, unit='B', versus='pairs')
+
+
+# Codecs
+
+@benchmark('codec')
+def codec_benchmark():
+  value = {'id': 1, 'method': 'ping', 'params': ['a', 1.5]}
+  for format in ('yaml', 'json', 'cjson', 'cbor'):
+    code = ard.encode(value, format)
+    binary = format == 'cbor'
+    if binary:
+      code = binascii.a2b_base64(code)
+    new_stream = (lambda: io.BytesIO(code)) if binary else (lambda: io.StringIO(code))
+    new_buffer = io.BytesIO if binary else io.StringIO
+    number = 200 if format == 'yaml' else 5000
+
+    report('codec', 'read (new reader)', format, measure(lambda: ard.reader(format).read(new_stream()), number))
+    report('codec', 'read (pooled reader)', format, measure(lambda: ard.read(new_stream(), format), number))
+    report('codec', 'write (new writer)', format, measure(lambda: ard.writer(format).write(value, new_buffer()), number))
+    report('codec', 'write (pooled writer)', format, measure(lambda: ard.write(value, new_buffer(), format), number))
+
+@benchmark('write-all')
+def write_all_benchmark():
+  values = records_document(100000)
+  for format in ('json', 'cjson', 'cbor'):
+    if format == 'json':
+      values_ = [dict(value, blob=None) for value in values]
+    else:
+      values_ = values
+
+    def one_by_one():
+      writer = NullWriter()
+      for value in values_:
+        ard.write(value, writer, format)
+
+    def write_all():
+      ard.write_all(values_, NullWriter(), format)
+
+    report('write-all', 'write per value', format, measure(one_by_one, 1) / 1000, unit='ms')
+    report('write-all', 'write_all', format, measure(write_all, 1) / 1000, unit='ms')
+
+@benchmark('cbor-bytes')
+def cbor_bytes_benchmark():
+  for size in (1, 100, 10000):
+    value = records_document(size)
+    base64 = ard.encode_cbor(value)
+    raw = ard.encode_cbor_bytes(value)
+    number = max(1, 10000 // size)
+    report('cbor-bytes', 'encode (base64)', size, measure(lambda: ard.encode_cbor(value), number))
+    report('cbor-bytes', 'encode (raw)', size, measure(lambda: ard.encode_cbor_bytes(value), number))
+    report('cbor-bytes', 'encode (canonical)', size, measure(lambda: ard.encode_cbor_bytes(value, canonical=True), number))
+    report('cbor-bytes', 'digest', size, measure(lambda: ard.digest(value), number))
+    report('cbor-bytes', 'digest (bytes)', size, measure(lambda: ard.digest_bytes(raw), number))
+    report('cbor-bytes', 'decode (base64)', size, measure(lambda: ard.decode_cbor(base64), number))
+    report('cbor-bytes', 'decode (raw)', size, measure(lambda: ard.decode_cbor_bytes(raw), number))
+
+
+# JSON
+
+@benchmark('json-backends')
+def json_backends_benchmark():
+  for size in (10, 1000, 100000):
+    # JSON has no bytes
+    value = records_document(size)
+    for record in value:
+      del record['blob']
+    code = ard.json.StandardBackend().encoder()(value)
+    number = max(1, 1000 // size)
+    for name, backend in ard.json.BACKENDS.items():
+      try:
+        backend = backend()
+      except ImportError:
+        continue
+      reader = ard.json.Reader(backend)
+      writer = ard.json.Writer('', backend)
+      report('json-backends', 'read ({})'.format(name), size, measure(lambda: reader.read(io.StringIO(code)), number) / 1000, unit='ms')
+      report('json-backends', 'write ({})'.format(name), size, measure(lambda: writer.write(value, NullWriter()), number) / 1000, unit='ms')
+
+
+# CJSON
+
+@benchmark('cjson-write')
+def cjson_write_benchmark():
+  writer = NullWriter()
+  for size in (10, 1000, 100000):
+    value = records_document(size)
+    number = max(1, 1000 // size)
+
+    def two_pass():
+      json.dump(ard.cjson.convert_to(value), writer, ensure_ascii=False)
+
+    def streaming():
+      ard.cjson.write(value, writer)
+
+    two_pass_time = measure(two_pass, number)
+    report('cjson-write', 'two-pass (time)', size, two_pass_time / 1000, unit='ms')
+    report('cjson-write', 'streaming (time)', size, measure(streaming, number) / 1000, unit='ms')
+    report('cjson-write', 'two-pass (peak memory)', size, measure_peak_memory(two_pass) / 1024, unit='KiB')
+    report('cjson-write', 'streaming (peak memory)', size, measure_peak_memory(streaming) / 1024, unit='KiB')
+
+    # Nothing to encode
+    plain = plain_document(size)
+    report('cjson-write', 'plain', size, measure(lambda: ard.cjson.write(plain, writer), number) / 1000, unit='ms')
+    report('cjson-write', 'plain (json)', size, measure(lambda: json.dump(plain, writer, ensure_ascii=False), number) / 1000, unit='ms')
+
+@benchmark('cjson-read')
+def cjson_read_benchmark():
+  for size in (10, 1000, 100000):
+    code = ard.encode(records_document(size), 'cjson')
+    number = max(1, 1000 // size)
+
+    def two_pass():
+      ard.cjson.convert_from(json.load(io.StringIO(code)))
+
+    def hooked():
+      ard.cjson.read(io.StringIO(code))
+
+    two_pass_time = measure(two_pass, number)
+    report('cjson-read', 'two-pass', size, two_pass_time / 1000, unit='ms')
+    report('cjson-read', 'object_pairs_hook', size, measure(hooked, number) / 1000, unit='ms')
+
+    # No codes
+    plain = ard.encode(plain_document(size), 'cjson')
+    report('cjson-read', 'plain', size, measure(lambda: ard.cjson.read(io.StringIO(plain)), number) / 1000, unit='ms')
+    report('cjson-read', 'plain (object_pairs_hook)', size, measure(lambda: json.loads(plain, object_pairs_hook=ard.cjson.object_pairs_hook), number) / 1000, unit='ms')
+
+
+# Converters
+
+@benchmark('converters')
+def converters_benchmark():
+  for shape, document in (('deep', deep_document), ('wide', wide_document)):
+    for size in (100, 10000, 100000):
+      value = document(size)
+      cjson = ard.cjson.convert_to(value)
+      number = max(1, 10000 // size)
+      report('converters', 'cjson.convert_to ({})'.format(shape), size, measure(lambda: ard.cjson.convert_to(value), number) / 1000, unit='ms')
+      report('converters', 'cjson.convert_from ({})'.format(shape), size, measure(lambda: ard.cjson.convert_from(cjson), number) / 1000, unit='ms')
+      report('converters', 'cbor.convert_frozen... ({})'.format(shape), size, measure(lambda: ard.cbor.convert_frozendicts_to_maps(value), number) / 1000, unit='ms')
+
+
+# CBOR
+
+@benchmark('cbor-read')
+def cbor_read_benchmark():
+  for size in (10, 1000, 100000):
+    buffer = io.BytesIO()
+    ard.write_cbor(records_document(size), buffer)
+    code = buffer.getvalue()
+    number = max(1, 1000 // size)
+
+    def two_pass():
+      ard.cbor.convert_frozendicts_to_maps(cbor2.load(io.BytesIO(code)))
+
+    def hooked():
+      ard.cbor.read(io.BytesIO(code))
+
+    report('cbor-read', 'two-pass', size, measure(two_pass, number) / 1000, unit='ms')
+    report('cbor-read', 'object_hook', size, measure(hooked, number) / 1000, unit='ms')
+
+
+@benchmark('cbor-lazy')
+def cbor_lazy_benchmark():
+  for size in (10, 1000, 100000):
+    value = {'header': {'id': 1, 'route': 'a'}, 'records': records_document(size), 'trailer': 5}
+    code = ard.encode_cbor_bytes(value)
+    number = max(1, 1000 // size)
+    report('cbor-lazy', 'eager (header)', size, measure(lambda: ard.decode_cbor_bytes(code)['header']['route'], number) / 1000, unit='ms')
+    report('cbor-lazy', 'lazy (header)', size, measure(lambda: ard.decode_cbor_lazy(code)['header']['route'], number) / 1000, unit='ms')
+    report('cbor-lazy', 'lazy (middle record)', size, measure(lambda: ard.decode_cbor_lazy(code)['records'][size // 2]['name'], number) / 1000, unit='ms')
+    report('cbor-lazy', 'lazy (trailer)', size, measure(lambda: ard.decode_cbor_lazy(code)['trailer'], number) / 1000, unit='ms')
+
+
+@benchmark('extract')
+def extract_benchmark():
+  for size in (10, 1000, 100000):
+    value = {'header': {'id': 1, 'route': 'a'}, 'records': records_document(size), 'trailer': 5}
+    number = max(1, 1000 // size)
+    for format in ('cjson', 'cbor'):
+      code = ard.encode(value, format, binary=True)
+      report('extract', 'decode ({})'.format(format), size, measure(lambda: ard.decode(code, format)['header']['route'], number) / 1000, unit='ms')
+      report('extract', 'extract header ({})'.format(format), size, measure(lambda: ard.extract(io.BytesIO(code), format, [['header', 'route']]), number) / 1000, unit='ms')
+      report('extract', 'extract trailer ({})'.format(format), size, measure(lambda: ard.extract(io.BytesIO(code), format, [['trailer']]), number) / 1000, unit='ms')
+
+
+@benchmark('cache')
+def cache_benchmark():
+  for size in (10, 1000, 100000):
+    number = max(1, 1000 // size)
+    for format in ('cjson', 'cbor'):
+      code = ard.encode(records_document(size), format, binary=True)
+      cache = ard.DecodeCache(max_bytes=len(code))
+      report('cache', 'decode ({})'.format(format), size, measure(lambda: ard.decode(code, format), number) / 1000, unit='ms')
+      report('cache', 'miss ({})'.format(format), size, measure(lambda: (cache.clear(), cache.decode(code, format)), number) / 1000, unit='ms')
+      report('cache', 'hit ({})'.format(format), size, measure(lambda: cache.decode(code, format), number) / 1000, unit='ms')
+
+@benchmark('immutable')
+def immutable_benchmark():
+  for size in (10, 1000, 100000):
+    value = {'header': {'id': 1, 'route': 'a'}, 'records': records_document(size)}
+    frozen = ard.freeze(value)
+    number = max(1, 1000 // size)
+    report('immutable', 'deepcopy', size, measure(lambda: copy.deepcopy(value), number) / 1000, unit='ms')
+    report('immutable', 'freeze', size, measure(lambda: ard.freeze(value), number) / 1000, unit='ms')
+    report('immutable', 'freeze (frozen)', size, measure(lambda: ard.freeze(frozen), number) / 1000, unit='ms')
+    report('immutable', 'evolve (header)', size, measure(lambda: ard.evolve(frozen, ('header', 'route'), 'b'), number) / 1000, unit='ms')
+    report('immutable', 'evolve (middle record)', size, measure(lambda: ard.evolve(frozen, ('records', size // 2, 'name'), 'x'), number) / 1000, unit='ms')
+
+@benchmark('aio')
+def aio_benchmark():
+  values = records_document(100000)
+  for format in ('json', 'cjson', 'cbor'):
+    if format == 'json':
+      values_ = [dict(value, blob=None) for value in values]
+    else:
+      values_ = values
+    buffer = io.BytesIO() if format == 'cbor' else io.StringIO()
+    ard.write_all(values_, buffer, format)
+    code = buffer.getvalue()
+    if format != 'cbor':
+      code = code.encode('utf-8')
+
+    async def chunks():
+      for offset in range(0, len(code), 64 * 1024):
+        yield code[offset:offset + 64 * 1024]
+
+    async def read_all():
+      async for _ in ard.aio.read_all(chunks(), format):
+        pass
+
+    def read_all_sync():
+      stream = io.BytesIO(code) if format == 'cbor' else io.StringIO(str(code, 'utf-8'))
+      for _ in ard.read_all(stream, format):
+        pass
+
+    report('aio', 'read_all', format, measure(read_all_sync, 1) / 1000, unit='ms')
+    report('aio', 'async read_all', format, measure(lambda: asyncio.run(read_all()), 1) / 1000, unit='ms')
+    report('aio', 'async write_all', format, measure(lambda: asyncio.run(ard.aio.write_all(values_, AsyncNullWriter(), format)), 1) / 1000, unit='ms')
+
+@benchmark('buffers')
+def buffers_benchmark():
+  for size in (1, 16):
+    # A slice of a large buffer, as with an mmap
+    buffer = memoryview(bytearray(size * 1024 * 1024 + 1))[1:]
+    value = {'blob': buffer}
+    for format in ('cjson', 'xml', 'cbor'):
+      def write():
+        ard.write(value, NullWriter(), format)
+      report('buffers', 'write ({})'.format(format), size, measure(write, 3) / 1000, unit='ms')
+      report('buffers', 'write ({}) (peak memory)'.format(format), size, measure_peak_memory(write) / 1024, unit='KiB')
+    code = ard.encode_cbor_bytes(value)
+    report('buffers', 'lazy blob', size, measure(lambda: ard.decode_cbor_lazy(code)['blob'], 3) / 1000, unit='ms')
+    report('buffers', 'lazy blob (memoryviews)', size, measure(lambda: ard.decode_cbor_lazy(code, True)['blob'], 3) / 1000, unit='ms')
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Run ARD benchmarks')
+  parser.add_argument('names', type=str, nargs='*', help='benchmarks to run (all if not provided)')
+  parser.add_argument('--list', '-l', action='store_true', help='list the benchmarks')
+  parser.add_argument('--json', '-j', type=str, metavar='FILE', help='save the results as JSON')
+  parser.add_argument('--baseline', '-b', type=str, metavar='FILE', help='compare with results saved by --json')
+  parser.add_argument('--json-backend', type=str, choices=tuple(ard.json.BACKENDS), default=os.environ.get('ARD_JSON_BACKEND') or 'json', help='default JSON library (default from ARD_JSON_BACKEND)')
+  args = parser.parse_args()
+
+  if args.list:
+    for name in benchmarks:
+      print(name)
+    return
+
+  for name in args.names:
+    if name not in benchmarks:
+      parser.error('unknown benchmark: ' + name)
+
+  try:
+    ard.json.set_backends(args.json_backend, args.json_backend)
+  except (ValueError, ImportError) as e:
+    parser.error(str(e))
+
+  if args.baseline is not None:
+    saved.update(load_results(args.baseline))
+
+  for name in args.names or benchmarks:
+    benchmarks[name]()
+
+  if args.json is not None:
+    save_results(args.json)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import unittest, ard, json, sys, io
+import unittest, ard, json, sys, io, os, pickle, asyncio, subprocess, tempfile, cbor2
 
 
 data = {
@@ -37,6 +37,9 @@ class Write(unittest.TestCase):
   def test_cjson(self):
     ard.write(data, sys.stdout, 'cjson')
 
+  def test_xml(self):
+    ard.write(data, sys.stdout, 'xml', '  ')
+
   def test_cbor(self):
     ard.write(data, sys.stdout.buffer, 'cbor')
 
@@ -51,12 +54,261 @@ class Code(unittest.TestCase):
   def test_cbor(self):
     self._roundtrip(data, 'cbor')
 
+  def test_xml(self):
+    self._roundtrip(data, 'xml')
+    self._roundtrip(['\r\n <&> ', '', float('inf'), [], {}, None, True], 'xml')
+    self.assertEqual(ard.decode(ard.encode(data, 'xml', indent='  '), 'xml'), data)
+    self.assertEqual(ard.decode('<list><integer> 1 </integer><map/></list>', 'xml'), [1, {}])
+    self.assertRaises(ard.EncodeError, ard.encode, '\x00', 'xml')
+    self.assertRaises(ard.DecodeError, ard.decode, '<list><entry/></list>', 'xml')
+
+  def test_binary(self):
+    for format in ('yaml', 'json', 'cjson', 'xml', 'cbor'):
+      value = {'text': 'ünicode', 'list': [1, 2]}
+      code = ard.encode(value, format, binary=True)
+      self.assertIsInstance(code, bytes)
+      for code_ in (code, bytearray(code), memoryview(code), memoryview(b'..' + code)[2:]):
+        self.assertEqual(ard.decode(code_, format), value)
+
+  def test_cbor_bytes(self):
+    code = ard.encode_cbor_bytes(data)
+    self.assertEqual(code, cbor2.dumps(ard.decode_cbor_bytes(code), default=ard.cbor.encoder_default))
+    self.assertEqual(ard.decode_cbor(ard.encode_cbor(data)), ard.decode_cbor_bytes(code))
+
   def _roundtrip(self, value, format):
     code = ard.encode(value, format)
     decoded = ard.decode(code, format)
     self.assertEqual(value, decoded)
 
 
+class Codec(unittest.TestCase):
+  def test_reuse(self):
+    for format in ('yaml', 'json', 'cjson', 'xml', 'cbor'):
+      reader = ard.reader(format)
+      writer = ard.writer(format)
+      for value in ({'a': [1, 2]}, 'value'):
+        buffer = io.BytesIO() if format == 'cbor' else io.StringIO()
+        writer.write(value, buffer)
+        buffer.seek(0)
+        self.assertEqual(reader.read(buffer), value)
+
+  def test_binary_streams(self):
+    for format in ('json', 'cjson'):
+      self.assertEqual(ard.read(io.BytesIO(b'{"a": 1}'), format), {'a': 1})
+      self.assertEqual(ard.read(io.BytesIO('["ü"]'.encode('utf-16')), format), ['ü'])
+      self.assertEqual(list(ard.read_all(io.BytesIO(b'{"a": 1}\n\n[2]\n'), format)), [{'a': 1}, [2]])
+    self.assertEqual(ard.read(io.BytesIO(b'{"a": {"$ard.integer": "1"}}'), 'cjson'), {'a': 1})
+
+  def test_pool(self):
+    pool = ard.codec.Pool(ard.reader)
+    reader = pool.acquire('json')
+    self.assertIsNot(pool.acquire('json'), reader)
+    pool.release(reader, 'json')
+    self.assertIs(pool.acquire('json'), reader)
+
+
+class ReadAll(unittest.TestCase):
+  def test_yaml(self):
+    self._read_all(io.StringIO('a: 1\n---\n{complex: key}: 2\n---\n[3]\n'), 'yaml')
+
+  def test_json(self):
+    self._read_all(io.StringIO('{"a": 1}\n\n[3]\n'), 'json', complex=False)
+
+  def test_cjson(self):
+    self._read_all(io.StringIO('{"a": {"$ard.integer": "1"}}\n{"$ard.map": [{"key": {"complex": "key"}, "value": 2}]}\n[3]\n'), 'cjson')
+
+  def test_cbor(self):
+    code = cbor2.dumps({'a': 1}) + cbor2.dumps({cbor2.FrozenDict({'complex': 'key'}): 2}) + cbor2.dumps([3])
+    self._read_all(io.BytesIO(code), 'cbor')
+    self.assertRaises(ard.DecodeError, list, ard.read_all(io.BytesIO(code[:-1]), 'cbor'))
+    # Streams that can neither peek nor seek
+    self._read_all(UnseekableReader(code), 'cbor')
+    self.assertRaises(ard.DecodeError, list, ard.read_all(UnseekableReader(code[:-1]), 'cbor'))
+
+  def _read_all(self, stream, format, complex=True):
+    values = ard.read_all(stream, format)
+    self.assertEqual(next(values), {'a': 1})
+    # Interleaved use of the same format must not interfere
+    self.assertEqual(ard.decode(ard.encode('other', format), format), 'other')
+    if complex:
+      self.assertEqual(next(values), ard.Map((({'complex': 'key'}, 2),)))
+    self.assertEqual(list(values), [[3]])
+
+
+class UnseekableReader(io.RawIOBase):
+  def __init__(self, data):
+    self.data = io.BytesIO(data)
+
+  def readable(self):
+    return True
+
+  def read(self, size=-1):
+    # Short reads, as from a pipe
+    return self.data.read(min(size, 3) if size >= 0 else size)
+
+
+class WriteAll(unittest.TestCase):
+  values = ({'a': 1}, ard.Map((({'complex': 'key'}, b'\x00'),)), [ard.UInteger(3)])
+
+  def test_yaml(self):
+    self._roundtrip('yaml', self.values)
+
+  def test_json(self):
+    self._roundtrip('json', ({'a': 1}, [3]))
+
+  def test_cjson(self):
+    self._roundtrip('cjson', self.values)
+
+  def test_cbor(self):
+    self._roundtrip('cbor', self.values)
+
+  def test_batching(self):
+    writer = CountingWriter()
+    ard.write_all(({'index': i} for i in range(10000)), writer, 'cbor')
+    self.assertLess(writer.count, 10)
+    self.assertEqual(len(list(ard.read_all(io.BytesIO(writer.getvalue()), 'cbor'))), 10000)
+
+  def _roundtrip(self, format, values):
+    buffer = io.BytesIO() if format == 'cbor' else io.StringIO()
+    ard.write_all(iter(values), buffer, format)
+    buffer.seek(0)
+    self.assertEqual(list(ard.read_all(buffer, format)), list(values))
+
+
+class CountingWriter(io.BytesIO):
+  def __init__(self):
+    super().__init__()
+    self.count = 0
+
+  def write(self, data):
+    self.count += 1
+    return super().write(data)
+
+
+class Aio(unittest.TestCase):
+  values = WriteAll.values + (b'\x01' * 100000,)
+
+  def test_roundtrip(self):
+    for format in ('cjson', 'cbor'):
+      writer = AsyncWriter()
+      asyncio.run(ard.aio.write_all(self.values, writer, format))
+      self.assertEqual(writer.drains, 1)
+      for size in (1, 7, 100000):
+        self.assertEqual(self._read_all(writer.chunks(size), format), list(self.values), (format, size))
+
+  def test_async_values(self):
+    async def values():
+      for value in ({'a': 1}, [2]):
+        yield value
+    writer = AsyncWriter()
+    asyncio.run(ard.aio.write_all(values(), writer, 'json'))
+    self.assertEqual(writer.drains, 2)
+    self.assertEqual(self._read_all(writer.chunks(3), 'json'), [{'a': 1}, [2]])
+
+  def test_stream_reader(self):
+    async def read_all():
+      reader = asyncio.StreamReader()
+      reader.feed_data(b'{"a": 1}\n\n[2]')
+      reader.feed_eof()
+      return [value async for value in ard.aio.read_all(reader)]
+    self.assertEqual(asyncio.run(read_all()), [{'a': 1}, [2]])
+
+  def test_errors(self):
+    code = ard.encode_cbor_bytes([1, 2])
+    self.assertRaises(ard.DecodeError, self._read_all, AsyncWriter.split(code[:-1], 1), 'cbor')
+    self.assertRaises(ard.DecodeError, self._read_all, AsyncWriter.split(b'[1,\n', 2), 'json')
+    self.assertRaises(ard.EncodeError, asyncio.run, ard.aio.write_all((object(),), AsyncWriter(), 'cbor'))
+
+  def _read_all(self, chunks, format):
+    async def read_all():
+      return [value async for value in ard.aio.read_all(chunks, format)]
+    return asyncio.run(read_all())
+
+
+class AsyncWriter:
+  def __init__(self):
+    self.data = bytearray()
+    self.drains = 0
+
+  def write(self, data):
+    self.data += data
+
+  async def drain(self):
+    self.drains += 1
+
+  def chunks(self, size):
+    return self.split(bytes(self.data), size)
+
+  @staticmethod
+  async def split(data, size):
+    for offset in range(0, len(data), size):
+      yield data[offset:offset + size]
+
+
+class JSON(unittest.TestCase):
+  def test_backends(self):
+    value = {
+      'string': 'ünicode/slash',
+      'uinteger': ard.UInteger(100),
+      'big': [2**64, -2**63 - 1, 12345678901234567890123],
+      'float': 12.23,
+      'non-string-key': {1: 2},
+      'map': ard.Map((('simple', 100),)),
+      'complex-key': ard.Map(((('a', 'b'), 200),))}
+    expected = json.loads(ard.json.StandardBackend().encoder('  ')(value))
+    for name in ard.json.BACKENDS:
+      try:
+        backend = ard.json.BACKENDS[name]()
+      except ImportError:
+        continue
+      for indent in ('', '  ', '\t'):
+        writer = ard.json.Writer(indent, backend)
+        stream = io.StringIO()
+        writer.write(value, stream)
+        self.assertEqual(json.loads(stream.getvalue()), expected, name)
+        self.assertEqual(ard.json.Reader(backend).read(io.StringIO(stream.getvalue())), expected, name)
+      self.assertRaises(TypeError, backend.encoder(), {'bytes': b'x'})
+
+  def test_invalid(self):
+    invalid = ('[1,]', '{"a" 1}', '[1', 'tru', '[1 2]')
+    # ujson accepts these
+    malformed = ('[-, 01, -]', '{"a": -}', '"a\x01b"', '01')
+    for name in ard.json.BACKENDS:
+      try:
+        backend = ard.json.BACKENDS[name]()
+      except ImportError:
+        continue
+      reader = ard.json.Reader(backend)
+      for code in invalid + (() if name == 'ujson' else malformed):
+        self.assertRaises(ValueError, reader.read, io.StringIO(code))
+    for code in invalid + malformed:
+      self.assertRaises(ard.DecodeError, ard.decode, code, 'json')
+      self.assertRaises(ard.DecodeError, ard.decode, '{"a": ' + code + '}', 'cjson')
+
+  def test_non_finite(self):
+    value = [float('nan'), {'a': float('inf')}, ard.Map(((1, -float('inf')),))]
+    for name in ard.json.BACKENDS:
+      try:
+        backend = ard.json.BACKENDS[name]()
+      except ImportError:
+        continue
+      code = backend.encoder()(value)
+      self.assertNotIn('null', code, name)
+      decoded = ard.json.Reader(backend).read(io.StringIO(code))
+      self.assertNotEqual(decoded[0], decoded[0])
+      self.assertEqual(decoded[1:], [{'a': float('inf')}, {'1': -float('inf')}])
+    self.assertEqual(ard.encode(float('nan'), 'json'), 'NaN\n')
+
+  def test_set_backends(self):
+    backends = ard.json.get_backends()
+    try:
+      ard.json.set_backends('json', 'json')
+      self.assertEqual(ard.decode(ard.encode([1, {'a': 2}], 'json'), 'json'), [1, {'a': 2}])
+      self.assertRaises(ValueError, ard.json.set_backends, 'unknown')
+    finally:
+      ard.json._decoding, ard.json._encoding = backends
+
+
 class CJSON(unittest.TestCase):
   def test_data(self):
     self._roundtrip(data)
@@ -64,6 +316,50 @@ class CJSON(unittest.TestCase):
   def test_from_yaml(self):
     self._roundtrip(ard.decode(yaml_code))
 
+  def test_write(self):
+    for indent in ('', '  '):
+      for value in (data, ard.decode(yaml_code), [[], {}, True, None, float('nan')]):
+        buffer = io.StringIO()
+        ard.cjson.write(value, buffer, indent)
+        self.assertEqual(buffer.getvalue(), json.dumps(ard.cjson.convert_to(value), ensure_ascii=False, indent=indent or None))
+
+  def test_read(self):
+    for value in (data, ard.decode(yaml_code), [[1, b'\x00'], {'list': [ard.UInteger(1)]}]):
+      code = ard.encode(value, 'cjson')
+      decoded = ard.cjson.read(io.StringIO(code))
+      self.assertEqual(decoded, ard.cjson.convert_from(json.loads(code)))
+      self.assertEqual(decoded, value)
+
+  def test_plain(self):
+    for code in ('{"price": "$5", "list": [1, 2.5, null]}', '{"$ard.integer": "5"}', '{"\\u0024ard.integer": "5"}', '{"$\\u0061rd.integer": "5"}', '{"$$ard.map": [1]}'):
+      self.assertEqual(ard.decode(code, 'cjson'), json.loads(code, object_pairs_hook=ard.cjson.object_pairs_hook), code)
+    value = {'a': [1.5, 'b', {'c': None}], 'd': True}
+    self.assertIs(ard.cjson.convert_to(value), value)
+    self.assertEqual(ard.encode({'$ard.map': [1.5]}, 'cjson'), '{"$$ard.map": [1.5]}\n')
+    buffer = io.StringIO()
+    ard.write_all([value, {'e': 1}], buffer, 'cjson')
+    self.assertEqual(buffer.getvalue(), json.dumps(value, ensure_ascii=False) + '\n{"e": {"$ard.integer": "1"}}\n')
+
+  def test_duplicate_keys(self):
+    for code in ('{"$ard.integer": "1", "$ard.integer": "2"}', '{"$$a": 1, "$$a": 2}', '{"a": 1, "a": 2}'):
+      value = json.loads(code, object_pairs_hook=ard.cjson.object_pairs_hook)
+      self.assertEqual(value, ard.cjson.convert_from(json.loads(code)), code)
+      self.assertEqual(ard.decode(code, 'cjson'), value, code)
+    self.assertEqual(ard.decode('{"$ard.integer": "1", "$ard.integer": "2"}', 'cjson'), 2)
+
+  def test_deep(self):
+    depth = sys.getrecursionlimit() * 10
+    value = 'leaf'
+    for i in range(depth):
+      value = [{'depth': i, 'child': value}]
+    cjson = ard.cjson.convert_to(value)
+    self.assertEqual(cjson[0]['depth'], {'$ard.integer': str(depth - 1)})
+    rt = ard.cjson.convert_from(cjson)
+    for _ in range(depth):
+      self.assertEqual(type(rt[0]['depth']), int)
+      rt = rt[0]['child']
+    self.assertEqual(rt, 'leaf')
+
   def _roundtrip(self, data):
     cjson = ard.cjson.convert_to(data)
     rt = ard.cjson.convert_from(cjson)
@@ -77,5 +373,454 @@ class CJSON(unittest.TestCase):
     self.assertEqual(data, rt)
 
 
+class CBOR(unittest.TestCase):
+  def test_read(self):
+    for value in (data, ard.decode(yaml_code), {'nested': ard.Map(((ard.Map(complex={'key': 2}), 3),))}):
+      buffer = io.BytesIO()
+      ard.write(value, buffer, 'cbor')
+      decoded = ard.cbor.read(io.BytesIO(buffer.getvalue()))
+      self.assertEqual(decoded, ard.cbor.convert_frozendicts_to_maps(cbor2.loads(buffer.getvalue())))
+      self.assertEqual(decoded, value)
+
+  def test_no_complex_keys(self):
+    decoded = ard.cbor.read(io.BytesIO(cbor2.dumps({'a': {'b': [1, 2]}})))
+    self.assertIs(type(decoded), dict)
+    self.assertIs(type(decoded['a']), dict)
+
+  def test_canonical(self):
+    # The example in RFC 8949 section 4.2.1
+    keys = [10, 100, -1, 'z', 'aa', [100], [-1], False]
+    map_ = ard.Map((key, None) for key in reversed(keys))
+    self.assertEqual(ard.encode_cbor_bytes(map_, canonical=True).hex(), 'a80af61864f620f6617af6626161f6811864f68120f6f4f6')
+    value = {'b': [{'y': 1, 'x': 2}], 'a': ard.Map(((ard.Map(b=1, a=2), 1.5), (1, 1.0)))}
+    same = ard.Map((('a', {1: 1.0, ard.Map(a=2, b=1): 1.5}), ('b', [ard.Map(x=2, y=1)])))
+    code = ard.encode_cbor_bytes(value, canonical=True)
+    self.assertEqual(code, ard.encode(same, 'cbor', binary=True, canonical=True))
+    self.assertEqual(ard.decode_cbor_bytes(code), value)
+    self.assertIn(bytes.fromhex('f93e00'), code)
+    self.assertEqual(ard.digest_bytes(code), ard.digest(value))
+
+
+class Lazy(unittest.TestCase):
+  def test_access(self):
+    code = ard.encode_cbor_bytes(data)
+    value = ard.decode_cbor_lazy(code)
+    self.assertIsInstance(value, ard.lazy.LazyMap)
+    self.assertEqual(value['string'], 'mystring')
+    self.assertEqual(value['complex-key'][{'complex': 'key'}], 200)
+    self.assertNotIn('missing', value)
+    self.assertRaises(KeyError, lambda: value['missing'])
+    self.assertEqual(len(value), len(data))
+    self.assertEqual(value, ard.decode_cbor_bytes(code))
+    self.assertEqual(value['non-string-key'].materialize(), {1: 2})
+
+  def test_list(self):
+    # Indefinite lengths: [_ 1, [2, 3], [_ 4, 5]]
+    value = ard.decode_cbor_lazy(bytes.fromhex('9f018202039f0405ffff'))
+    self.assertIsInstance(value, ard.lazy.LazyList)
+    self.assertEqual(value[1][0], 2)
+    self.assertEqual(value[-1][1], 5)
+    self.assertEqual(len(value), 3)
+    self.assertEqual(value, [1, [2, 3], [4, 5]])
+    self.assertRaises(IndexError, lambda: value[3])
+
+  def test_skip(self):
+    for value in (data, [1.5, None, True, b'x' * 1000, 2**70], 'text'):
+      code = ard.encode_cbor_bytes(value)
+      self.assertEqual(ard.lazy.skip_item(code, 0), len(code))
+      self.assertRaises(ValueError, ard.lazy.skip_item, code[:-1], 0)
+    # A truncated head
+    self.assertRaises(ValueError, ard.lazy.skip_item, b'\x19\x01', 0)
+    self.assertRaises(ard.DecodeError, lambda: ard.decode_cbor_lazy(b'\x82\x01')[1])
+
+  def test_encode(self):
+    code = ard.encode_cbor_bytes({'list': [1, {'b': 2.5}], 'map': {'c': [None]}})
+    value = ard.decode_cbor_bytes(code)
+    for format in ('yaml', 'json', 'cjson', 'xml', 'cbor'):
+      lazy = ard.decode_cbor_lazy(code)
+      self.assertEqual(ard.encode(lazy, format), ard.encode(value, format), format)
+      self.assertEqual(ard.encode([lazy['list']], format), ard.encode([value['list']], format), format)
+    self.assertEqual(ard.digest(ard.decode_cbor_lazy(code)), ard.digest(value))
+    self.assertEqual(ard.freeze(ard.decode_cbor_lazy(code)), ard.freeze(value))
+
+  def test_memoryviews(self):
+    code = ard.encode_cbor_bytes({'blob': b'x' * 1000, b'key': [b'ab', 'text']})
+    buffer = bytearray(code)
+    value = ard.decode_cbor_lazy(buffer, memoryviews=True)
+    blob = value['blob']
+    self.assertIsInstance(blob, memoryview)
+    self.assertEqual(blob, b'x' * 1000)
+    self.assertEqual(value[b'key'][0], b'ab')
+    self.assertEqual(value, ard.decode_cbor_bytes(code))
+    # The views are into the code
+    buffer[buffer.index(b'x')] = ord('y')
+    self.assertEqual(blob[:1], b'y')
+    self.assertIsInstance(ard.decode_cbor_lazy(code)['blob'], bytes)
+
+
+class Buffers(unittest.TestCase):
+  def test_encode(self):
+    blob = bytes(range(256)) * 1000
+    for buffer in (bytearray(blob), memoryview(blob), memoryview(bytearray(blob))[1:], memoryview(blob)[::3]):
+      expected = bytes(buffer)
+      for format in ('yaml', 'cjson', 'xml', 'cbor'):
+        for indent in ('', '  '):
+          code = ard.encode({'blob': buffer, 'list': [buffer]}, format, indent)
+          self.assertEqual(code, ard.encode({'blob': expected, 'list': [expected]}, format, indent))
+          self.assertEqual(ard.decode(code, format)['blob'], expected)
+      self.assertEqual(ard.digest(buffer), ard.digest(expected))
+      self.assertEqual(ard.cjson.convert_to(buffer), ard.cjson.convert_to(expected))
+
+
+class Extract(unittest.TestCase):
+  def test_extract(self):
+    paths = (
+      ('string',),
+      ('uinteger',),
+      ('bytes',),
+      ('escaped', '$ard.integer'),
+      ('non-string-key', 1),
+      ('complex-key', {'complex': 'key'}),
+      ('complex-key',),
+      ('missing',),
+      ('string', 'missing'))
+    expected = ['mystring', 100, data['bytes'], 'value', 2, 200, data['complex-key'], None, None]
+    for format in ('yaml', 'cjson', 'cbor'):
+      code = ard.encode(data, format, binary=True)
+      self.assertEqual(ard.extract(io.BytesIO(code), format, paths), expected, format)
+
+  def test_json(self):
+    code = '{"a": [1, {"b": "c"}], "d": {"e": null}, "f": "\\"}"}'
+    paths = (('a', 1, 'b'), ('a', -1), ('d', 'e'), ('f',), ('a', 5), ('d', 0))
+    self.assertEqual(ard.extract(io.StringIO(code), 'json', paths, 'default'), ['c', {'b': 'c'}, None, '"}', 'default', 'default'])
+    self.assertRaises(ard.DecodeError, ard.extract, io.StringIO('{"a": [1,'), 'json', (('a', 1),))
+
+  def test_duplicate_keys(self):
+    for format, code in (('json', '{"a": 1, "b": {"c": 2}, "a": 3}'), ('cjson', '{"a": 1, "b": {"c": 2}, "a": {"$ard.integer": "3"}}')):
+      self.assertEqual(ard.extract(io.StringIO(code), format, (('a',), ('b', 'c'))), [3, 2], format)
+      self.assertEqual(ard.extract(io.StringIO(code), format, (('a',),)), [ard.decode(code, format)['a']], format)
+    for code in ('{"a": 1, "\\u0061": 2}', '{"a": 1, "b": ["a"]}', '{"a/": 1, "a\\/": 2}'):
+      decoded = ard.decode(code, 'json')
+      self.assertEqual(ard.extract(io.StringIO(code), 'json', [(key,) for key in decoded]), list(decoded.values()), code)
+
+
+class Immutable(unittest.TestCase):
+  def test_freeze(self):
+    value = {'a': [1, {'b': bytearray(b'x')}], ard.Map(complex='key'): ({'c': []},)}
+    frozen = ard.freeze(value)
+    self.assertEqual(frozen, {'a': (1, {'b': b'x'}), ard.Map(complex='key'): ({'c': ()},)})
+    self.assertIsInstance(frozen, ard.Map)
+    self.assertIsInstance(frozen['a'][1]['b'], bytes)
+    self.assertRaises(TypeError, frozen['a'][1].pop, 'b')
+    self.assertEqual(hash(frozen), hash(ard.freeze(ard.Map(reversed(list(value.items()))))))
+    self.assertIs(ard.freeze(frozen), frozen)
+    self.assertEqual(value['a'], [1, {'b': bytearray(b'x')}])
+
+  def test_keys(self):
+    value = ard.Map((({'a': {'b': 1}}, 1), (('t', {'c': 2}), 2), ([{'d': 3}], 3)))
+    frozen = ard.freeze(value)
+    self.assertEqual(frozen, value)
+    self.assertEqual(hash(frozen), hash(ard.freeze(value)))
+    key, tuple_key, list_key = frozen
+    self.assertRaises(TypeError, key.pop, 'a')
+    self.assertRaises(TypeError, key['a'].pop, 'b')
+    self.assertRaises(TypeError, tuple_key[1].pop, 'c')
+    # Lists in keys remain lists, but their mappings are frozen
+    self.assertIsInstance(list_key, list)
+    self.assertRaises(TypeError, list_key[0].pop, 'd')
+    for key in ({'a': {'b': 1}}, ('t', {'c': 2}), [{'d': 3}]):
+      self.assertIn(key, frozen)
+    evolved = ard.evolve(frozen, ({'e': {'f': 4}},), 4)
+    self.assertRaises(TypeError, list(evolved)[-1]['e'].pop, 'f')
+
+  def test_evolve(self):
+    frozen = ard.freeze({'a': {'b': [1, 2, 3]}, 'c': {'d': 4}})
+    evolved = ard.evolve(frozen, ('a', 'b', 1), {'e': [5]})
+    self.assertEqual(evolved, {'a': {'b': (1, {'e': (5,)}, 3)}, 'c': {'d': 4}})
+    self.assertEqual(frozen, {'a': {'b': (1, 2, 3)}, 'c': {'d': 4}})
+    self.assertIs(evolved['c'], frozen['c'])
+    self.assertIs(ard.freeze(evolved), evolved)
+    self.assertEqual(ard.evolve(frozen, ('a', 'b', -1), delete=True), {'a': {'b': (1, 2)}, 'c': {'d': 4}})
+    self.assertEqual(ard.evolve(frozen, ('c', {'complex': 'key'}), 5)['c'], {'d': 4, ard.Map(complex='key'): 5})
+    self.assertEqual(ard.evolve({'a': [1]}, ('a', 0), 2), {'a': (2,)})
+    self.assertRaises(KeyError, ard.evolve, frozen, ('x', 'y'), 1)
+
+
+class Cache(unittest.TestCase):
+  def test_cache(self):
+    cache = ard.DecodeCache(max_entries=2, max_bytes=200)
+    value = cache.decode(yaml_code)
+    self.assertEqual(ard.digest(value), ard.digest(ard.decode(yaml_code)))
+    self.assertIs(cache.decode(yaml_code), value)
+    self.assertIsInstance(value['list-nesting'], tuple)
+    self.assertRaises(TypeError, value.pop, 'string')
+    self.assertRaises(TypeError, value['map-nesting'].clear)
+    self.assertRaises(TypeError, next(iter(value['map-nesting'])).pop, 'complex')
+
+    self.assertEqual(cache.decode(ard.encode_cbor_bytes([1]), 'cbor'), (1,))
+    # Too big to be cached
+    self.assertEqual(cache.decode(ard.encode_cbor(['x' * 200]), 'cbor'), ('x' * 200,))
+    self.assertEqual(cache.as_dict(), {'entries': 2, 'size': 183, 'hits': 1, 'misses': 3, 'evictions': 0})
+    cache.decode('[3]', 'json')
+    self.assertEqual(cache.as_dict(), {'entries': 2, 'size': 5, 'hits': 1, 'misses': 4, 'evictions': 1})
+    self.assertRaises(ard.DecodeError, cache.decode, '[', 'json')
+
+
+class Stats(unittest.TestCase):
+  def test_stats(self):
+    timings = []
+    code = ard.encode(data, 'cjson')
+    with ard.Stats(lambda phase, seconds: timings.append(phase)) as stats:
+      self.assertIs(ard.get_stats(), stats)
+      value = ard.decode(code, 'cjson')
+      ard.cjson.convert_to(value)
+      value['complex-key'][{'complex': 'key'}]
+      ard.encode(value, 'cbor')
+    self.assertIsNone(ard.get_stats())
+    self.assertEqual(set(stats.times), {'read.cjson', 'convert_to.cjson', 'write.cbor'})
+    self.assertEqual(set(timings), set(stats.times))
+    self.assertGreater(stats.nodes, 10)
+    self.assertGreater(stats.map_lookups, 0)
+    self.assertGreater(stats.key_comparisons, 0)
+
+    # Disabled
+    stats.reset()
+    ard.decode(code, 'cjson')
+    value['complex-key'][{'complex': 'key'}]
+    self.assertEqual(stats.as_dict(), {'times': {}, 'calls': {}, 'nodes': 0, 'map_lookups': 0, 'key_comparisons': 0})
+
+  def test_nesting(self):
+    outer = ard.Stats()
+    inner = ard.Stats()
+    with outer:
+      with inner:
+        self.assertIs(ard.get_stats(), inner)
+        self.assertRaises(ValueError, outer.disable)
+        self.assertRaises(ValueError, inner.enable)
+        ard.Map(a=1)['a']
+      self.assertIs(ard.get_stats(), outer)
+      ard.Map(a=1)['a']
+    self.assertIsNone(ard.get_stats())
+    self.assertRaises(ValueError, outer.disable)
+    self.assertEqual((outer.map_lookups, inner.map_lookups), (1, 1))
+    # Instrumentation is switched off
+    ard.Map(a=1)['a']
+    self.assertEqual(outer.map_lookups, 1)
+
+
+class Map(unittest.TestCase):
+  def test_order(self):
+    map_ = ard.Map()
+    map_['b'] = 1
+    map_[{'complex': 'key'}] = 2
+    map_[1] = 3
+    map_['a'] = 4
+    map_['b'] = 5
+    self.assertEqual(list(map_), ['b', {'complex': 'key'}, 1, 'a'])
+    self.assertEqual(list(map_.values()), [5, 2, 3, 4])
+    self.assertEqual(list(reversed(map_)), ['a', 1, {'complex': 'key'}, 'b'])
+
+  def test_lookup(self):
+    map_ = ard.Map(((str(i), i) for i in range(1000)))
+    map_[[1, 2]] = 'list'
+    map_[ard.Map(complex='key')] = 'map'
+    self.assertEqual(map_['500'], 500)
+    self.assertNotIn((1, 2), map_)
+    self.assertEqual(map_[[1, 2]], 'list')
+    self.assertEqual(map_[{'complex': 'key'}], 'map')
+    self.assertIn('999', map_)
+    self.assertNotIn('1000', map_)
+    self.assertEqual(map_.get('1000', 'default'), 'default')
+    self.assertRaises(KeyError, map_.__getitem__, [3])
+
+  def test_equality(self):
+    map_ = ard.Map((('a', [1, {'b': 2}]), ({'complex': 'key'}, 3)))
+    self.assertEqual(map_, ard.Map(((ard.Map(complex='key'), 3), ('a', [1, ard.Map(b=2)]))))
+    self.assertNotEqual(map_, ard.Map((('a', [1, {'b': 2}]), ({'complex': 'key'}, 4))))
+    self.assertEqual(ard.Map(a=1, b=[2]), {'b': [2], 'a': 1})
+    self.assertNotEqual(ard.Map(a=1, b=[2]), {'b': [3], 'a': 1})
+    self.assertEqual({'x': ard.Map(a=1)}, {'x': {'a': 1}})
+    key = ard.Map(complex='key')
+    self.assertEqual(ard.Map(((key, 1),)), {key: 1})
+
+  def test_digest(self):
+    map_ = ard.Map((('a', [1, {'b': 2.5}]), ({'complex': ['key']}, b'\x00'), ('c', None)))
+    same = ard.Map((('c', None), (ard.Map(complex=('key',)), b'\x00'), ('a', (1, {'b': 2.5}))))
+    self.assertEqual(ard.digest(map_), ard.digest(same))
+    self.assertEqual(ard.digest({'a': 1, 'b': 2}), ard.digest(ard.Map(b=2, a=1)))
+    self.assertNotEqual(ard.digest({'a': 1}), ard.digest({'a': 1.0}))
+    self.assertNotEqual(ard.digest({'a': 1}), ard.digest({'a': True}))
+    frozen = ard.freeze(same)
+    self.assertIs(ard.digest(frozen), ard.digest(frozen))
+    self.assertEqual(ard.digest(frozen), ard.digest(same))
+    # Only frozen at the top level, so the digest must follow changes to the values
+    map_ = ard.Map({'x': {'y': 1}})
+    hash(map_)
+    digest = ard.digest(map_)
+    map_['x']['y'] = 2
+    self.assertNotEqual(ard.digest(map_), digest)
+
+  def test_complex_keys(self):
+    map_ = ard.Map((({'id': i, 'tags': [i, i + 1]}, i) for i in range(1000)))
+    self.assertEqual(map_[{'tags': [500, 501], 'id': 500}], 500)
+    self.assertEqual(map_[ard.Map(id=999, tags=[999, 1000])], 999)
+    self.assertNotIn({'id': 500, 'tags': [500]}, map_)
+
+  def test_mixed_frozen_keys(self):
+    # Equal keys must be found whether their nested mappings are frozen Maps or dicts
+    for key, equal_key in (
+      ({'v': ('a', {'x': 1})}, {'v': ('a', ard.freeze({'x': 1}))}),
+      (('a', {'x': 1}), ('a', ard.freeze({'x': 1}))),
+      (({'a': 1},), (ard.Map(a=1),)),
+      ([('b', {'c': [1]})], [('b', ard.Map(c=[1]))])):
+      self.assertEqual(key, equal_key)
+      for key_, equal_key_ in ((key, equal_key), (equal_key, key)):
+        map_ = ard.Map()
+        map_[key_] = 1
+        self.assertIn(equal_key_, map_)
+        other = ard.Map()
+        other[equal_key_] = 1
+        self.assertEqual(map_, other)
+        self.assertEqual(hash(map_), hash(other))
+    code = cbor2.dumps({('a', cbor2.FrozenDict({'x': 1})): 5})
+    self.assertEqual(ard.decode_cbor_bytes(code)[('a', ard.freeze({'x': 1}))], 5)
+
+  def test_complex_key_removal(self):
+    map_ = ard.Map((([i], i) for i in range(100)))
+    for i in range(0, 100, 3):
+      del map_[[i]]
+    map_['a'] = 'a'
+    map_[[0]] = 0
+    self.assertEqual(len(map_), 68)
+    self.assertEqual(list(map_)[:3], [[1], [2], [4]])
+    self.assertEqual(list(reversed(map_))[:3], [[0], 'a', [98]])
+    self.assertNotIn([3], map_)
+    self.assertEqual(map_[[98]], 98)
+    self.assertEqual(map_.popitem(), ([0], 0))
+    self.assertEqual(map_.popitem(), ('a', 'a'))
+    expected = [([i], i) for i in range(100) if i % 3]
+    self.assertEqual(map_, ard.Map(expected))
+    self.assertEqual(map_, ard.Map(reversed(expected)))
+    self.assertEqual(hash(ard.freeze(map_)), hash(ard.freeze(ard.Map(reversed(expected)))))
+
+  def test_key_mutation(self):
+    key = ard.Map(complex='key')
+    map_ = ard.Map()
+    map_[key] = 1
+    self.assertRaises(TypeError, key.update, other='key')
+
+    key = {'complex': ['key']}
+    map_[key] = 2
+    key['complex'].append('modified')
+    map_.reindex()
+    self.assertEqual(map_[{'complex': ['key', 'modified']}], 2)
+
+  def test_hash(self):
+    map_ = ard.Map((('a', 1), ({'complex': 'key'}, [2])))
+    self.assertEqual(hash(map_), hash(ard.Map((({'complex': 'key'}, [2]), ('a', 1)))))
+    self.assertRaises(TypeError, map_.pop, 'a')
+
+  def test_mutation(self):
+    map_ = ard.Map({'a': 1, 'b': 2})
+    map_[[1]] = 3
+    self.assertEqual(map_.pop('a'), 1)
+    self.assertEqual(map_.pop('a', None), None)
+    self.assertRaises(KeyError, map_.pop, 'a')
+    self.assertEqual(map_.setdefault([1], 4), 3)
+    self.assertEqual(map_.setdefault('c', 5), 5)
+    del map_[[1]]
+    self.assertRaises(KeyError, map_.__delitem__, [1])
+    self.assertEqual(map_.popitem(), ('c', 5))
+    self.assertEqual(map_, {'b': 2})
+
+  def test_immutable(self):
+    for map_ in (ard.freeze({'a': 1}), ard.Map(a=1)):
+      map_.freeze()
+      with self.assertRaises(TypeError):
+        map_['a'] = 5
+      with self.assertRaises(TypeError):
+        del map_['a']
+      self.assertRaises(TypeError, map_.update, {'b': 2})
+      self.assertEqual(map_, {'a': 1})
+
+  def test_dict(self):
+    self.assertEqual(type(ard.Map({'a': 1, 2: 3}).dict()), dict)
+    map_ = ard.Map({'a': 1})
+    map_[{'complex': 'key'}] = 2
+    self.assertIs(map_.dict(), map_)
+    self.assertRaises(TypeError, map_.dict, strict=True)
+    self.assertRaises(TypeError, ard.Map({(1, 2): 3}).dict, strict=True, json=True)
+
+  def test_pickle(self):
+    map_ = ard.Map({'a': 1})
+    map_[{'complex': 'key'}] = 2
+    map_.freeze()
+    unpickled = pickle.loads(pickle.dumps(map_))
+    self.assertEqual(unpickled[{'complex': 'key'}], 2)
+    self.assertRaises(TypeError, unpickled.pop, 'a')
+    self.assertFalse(hasattr(unpickled, '__dict__'))
+
+  def test_copy(self):
+    map_ = ard.Map({'a': 1})
+    copy = map_.copy()
+    copy['b'] = 2
+    self.assertEqual(len(map_), 1)
+    self.assertEqual(copy | {'c': 3}, {'a': 1, 'b': 2, 'c': 3})
+
+
+class Ardconv(unittest.TestCase):
+  def run_ardconv(self, *args, **kwargs):
+    return subprocess.run((sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ardconv')) + args, capture_output=True, **kwargs)
+
+  def test_convert(self):
+    process = self.run_ardconv('-o', 'cbor', input=b'a: [1, 2]\n')
+    self.assertEqual(process.returncode, 0)
+    self.assertEqual(ard.decode(process.stdout, 'cbor'), {'a': [1, 2]})
+    with tempfile.TemporaryDirectory() as directory:
+      input = os.path.join(directory, 'in.cbor')
+      output = os.path.join(directory, 'out.json')
+      with open(input, 'wb') as f:
+        f.write(process.stdout)
+      process = self.run_ardconv('-i', 'cbor', '-o', 'json', input, output)
+      self.assertEqual(process.returncode, 0)
+      with open(output) as f:
+        self.assertEqual(ard.read(f, 'json'), {'a': [1, 2]})
+
+  def test_json_backend(self):
+    for name, backend in ard.json.BACKENDS.items():
+      try:
+        backend()
+      except ImportError:
+        continue
+      process = self.run_ardconv('-i', 'json', '-o', 'json', '--json-backend', name, input=b'{"a": [1, 2]}')
+      self.assertEqual(process.returncode, 0, name)
+      self.assertEqual(ard.decode(process.stdout, 'json'), {'a': [1, 2]}, name)
+    process = self.run_ardconv('-i', 'json', input=b'{}', env=dict(os.environ, ARD_JSON_BACKEND='unknown'))
+    self.assertEqual(process.returncode, 2)
+    self.assertIn(b'unsupported JSON backend', process.stderr)
+
+  def test_batch(self):
+    with tempfile.TemporaryDirectory() as directory:
+      for name, value in (('in1/x.yaml', {'a': 1}), ('in1/sub/y.yaml', [2]), ('in2/x.yaml', {'a': 3})):
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+          ard.write(value, f)
+      out = os.path.join(directory, 'out')
+      process = self.run_ardconv(
+        '-o', 'cbor', '-j', '1', '--batch', os.path.join(directory, 'in1'), os.path.join(directory, 'in2'),
+        os.path.join(directory, 'missing.yaml'), os.path.join(directory, '*.yaml'), '--output-dir', out,
+        text=True)
+      self.assertEqual(process.returncode, 1)
+      self.assertIn('converted 2 files, 3 failed', process.stderr)
+      self.assertIn('same output path', process.stderr)
+      self.assertIn('missing.yaml: no such file or directory', process.stderr)
+      self.assertIn('*.yaml: no files match', process.stderr)
+      with open(os.path.join(out, 'x.cbor'), 'rb') as f:
+        self.assertEqual(ard.decode(f.read(), 'cbor'), {'a': 1})
+      with open(os.path.join(out, 'sub', 'y.cbor'), 'rb') as f:
+        self.assertEqual(ard.decode(f.read(), 'cbor'), [2])
+
+
 if __name__ == '__main__':
   unittest.main()